@@ -3,13 +3,15 @@ import os
 from typing import List, Optional
 from .constant import DocumentType
 class Enhancer:
-    def __init__(self, model: str ,openai_api_key: Optional[str] = None):
+    def __init__(self, model: str ,openai_api_key: Optional[str] = None, base_url: Optional[str] = None):
         self.openai_api_key = openai_api_key or os.getenv('OPENAPI_KEY')
         if not self.openai_api_key:
             raise ValueError("OpenAI API key is required. Set it as an argument or in the environment variable 'OPENAPI_KEY'.")
         openai.api_key = self.openai_api_key
         self.model = model
-        self.client = openai.OpenAI(api_key=self.openai_api_key)
+        # Allows pointing the client at a compatible endpoint, e.g. the load-test stand-in
+        self.base_url = base_url or os.getenv('OPENAI_BASE_URL')
+        self.client = openai.OpenAI(api_key=self.openai_api_key, base_url=self.base_url)
 
     def enhance(self, text: str, document_type: DocumentType = DocumentType.PDF):
         enhanced_text = self.enhance_extraction(text, document_type)
@@ -0,0 +1,194 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import stat
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# SQLite file shared by the server and every parse process; an empty value disables the store.
+# Its directory must belong to the server's user and be writable by nobody else
+PAGE_CACHE_PATH = os.getenv("PAGE_CACHE_PATH", os.path.join(tempfile.gettempdir(), f"deepdoc-{os.geteuid()}", "page-cache.sqlite3"))
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", "2048"))
+# Total size of cached pages, which include the page images when they were collected
+PAGE_CACHE_BYTES = int(os.getenv("PAGE_CACHE_BYTES", str(256 * 1024 * 1024)))
+IMAGE_DESCRIPTION_CACHE_SIZE = int(os.getenv("IMAGE_DESCRIPTION_CACHE_SIZE", "4096"))
+# Bump when the stored format changes; entries written in another format are never read
+PAGE_CACHE_SCHEMA_VERSION = 1
+PAGES_TABLE = f"pages_v{PAGE_CACHE_SCHEMA_VERSION}"
+DESCRIPTIONS_TABLE = f"descriptions_v{PAGE_CACHE_SCHEMA_VERSION}"
+
+def page_fingerprint(pdf_document, page) -> str:
+    """
+    Fingerprint a PyMuPDF page from its content stream and the resources it draws with.
+
+    Args:
+        pdf_document (fitz.Document): The document the page belongs to.
+        page (fitz.Page): The page to fingerprint.
+
+    Returns:
+        str: A hex digest that only changes when the page content or its resources change.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr((tuple(page.mediabox), page.rotation)).encode())
+    digest.update(page.read_contents())
+    # Resource names are referenced from the content stream, so hash them with their definitions
+    for font in page.get_fonts():
+        digest.update(repr(font[1:6]).encode())
+    xobject_xrefs = [xobject[0] for xobject in page.get_xobjects()]
+    xobject_xrefs += [image[0] for image in page.get_images(full=True)]
+    for xref in xobject_xrefs:
+        if xref > 0:
+            digest.update(hashlib.sha256(pdf_document.xref_stream_raw(xref) or b"").digest())
+    return digest.hexdigest()
+
+def image_fingerprint(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def _encode_page_result(page_result: Tuple[str, List[Tuple]]) -> str:
+    page_class, elements = page_result
+    encoded = [list(element) if element[0] == "text" else ["image", base64.b64encode(element[1]).decode("ascii")]
+               for element in elements]
+    return json.dumps([page_class, encoded])
+
+def _decode_page_result(value: str) -> Tuple[str, List[Tuple]]:
+    page_class, encoded = json.loads(value)
+    elements = [tuple(element) if element[0] == "text" else ("image", base64.b64decode(element[1]))
+                for element in encoded]
+    return page_class, elements
+
+def _open_private_file(path: str):
+    # Cached pages hold document content, so refuse any file or directory another user controls or can read
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    directory_stat = os.lstat(directory)
+    if not stat.S_ISDIR(directory_stat.st_mode) or directory_stat.st_uid != os.geteuid() or directory_stat.st_mode & 0o022:
+        raise PermissionError(f"{directory} must be a directory owned and only writable by the server's user")
+    descriptor = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    try:
+        file_stat = os.fstat(descriptor)
+    finally:
+        os.close(descriptor)
+    if not stat.S_ISREG(file_stat.st_mode) or file_stat.st_uid != os.geteuid() or file_stat.st_mode & 0o077:
+        raise PermissionError(f"{path} must be a regular file owned and only readable by the server's user")
+
+class PageResultStore:
+    """
+    Bounded LRU store of per-page extraction results and image descriptions, so revised
+    documents only pay for the pages that actually changed. Entries live in a SQLite file,
+    since every document is parsed in a short-lived process of its own.
+    """
+    def __init__(self, path: str = PAGE_CACHE_PATH, max_pages: int = PAGE_CACHE_SIZE,
+                 max_descriptions: int = IMAGE_DESCRIPTION_CACHE_SIZE, max_page_bytes: int = PAGE_CACHE_BYTES):
+        self.path = path
+        self.max_pages = max_pages
+        self.max_descriptions = max_descriptions
+        self.max_page_bytes = max_page_bytes
+        self._connection = None
+        self._disabled = False
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get_page(self, fingerprint: str, include_images: bool) -> Optional[Tuple[str, List[Tuple]]]:
+        value = self._get(PAGES_TABLE, f"{fingerprint}:{int(include_images)}", self.max_pages)
+        if value is None:
+            return None
+        try:
+            return _decode_page_result(value)
+        except (ValueError, TypeError, IndexError) as e:
+            logger.warning(f"Ignoring unreadable page result store entry: {e}")
+            return None
+
+    def put_page(self, fingerprint: str, include_images: bool, page_result: Tuple[str, List[Tuple]]):
+        # A page result is the page class together with the page's elements
+        self._put(PAGES_TABLE, f"{fingerprint}:{int(include_images)}", _encode_page_result(page_result),
+                  self.max_pages, self.max_page_bytes)
+
+    def get_description(self, image_key: str) -> Optional[str]:
+        return self._get(DESCRIPTIONS_TABLE, image_key, self.max_descriptions)
+
+    def put_description(self, image_key: str, description: str):
+        self._put(DESCRIPTIONS_TABLE, image_key, description, self.max_descriptions)
+
+    def clear(self):
+        if not self.path or self._disabled:
+            return
+        with self._locked_connection() as connection:
+            connection.execute(f"DELETE FROM {PAGES_TABLE}")
+            connection.execute(f"DELETE FROM {DESCRIPTIONS_TABLE}")
+
+    @contextmanager
+    def _locked_connection(self):
+        # SQLite connections must not cross a fork, so every process opens its own
+        if self._pid != os.getpid():
+            self._connection = None
+            self._lock = threading.Lock()
+            self._pid = os.getpid()
+        with self._lock:
+            yield self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            _open_private_file(self.path)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            for table in (PAGES_TABLE, DESCRIPTIONS_TABLE):
+                connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                                   f"size INTEGER NOT NULL, used REAL NOT NULL)")
+                connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_used ON {table} (used)")
+            self._connection = connection
+        return self._connection
+
+    def _get(self, table: str, key: str, max_entries: int) -> Optional[str]:
+        if not self.path or self._disabled or max_entries <= 0:
+            return None
+        try:
+            with self._locked_connection() as connection:
+                row = connection.execute(f"SELECT value FROM {table} WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                connection.execute(f"UPDATE {table} SET used = ? WHERE key = ?", (time.time(), key))
+                return row[0]
+        except (sqlite3.Error, OSError) as e:
+            # The store only saves work, so a broken cache file must never fail a parse
+            self._handle_error("lookup", e)
+            return None
+
+    def _put(self, table: str, key: str, value: str, max_entries: int, max_bytes: Optional[int] = None):
+        if not self.path or self._disabled or max_entries <= 0:
+            return
+        size = len(value)
+        if max_bytes is not None and size > max_bytes:
+            return
+        try:
+            with self._locked_connection() as connection:
+                connection.execute(f"INSERT OR REPLACE INTO {table} (key, value, size, used) VALUES (?, ?, ?, ?)",
+                                   (key, value, size, time.time()))
+                # Evict least recently used entries beyond the entry count or the total size
+                connection.execute(
+                    f"DELETE FROM {table} WHERE key IN (SELECT key FROM ("
+                    f"SELECT key, ROW_NUMBER() OVER recent AS position, SUM(size) OVER recent AS total FROM {table} "
+                    f"WINDOW recent AS (ORDER BY used DESC, rowid DESC)) WHERE position > ? OR total > ?)",
+                    (max_entries, max_bytes if max_bytes is not None else sys.maxsize))
+        except (sqlite3.Error, OSError) as e:
+            self._handle_error("update", e)
+
+    def _handle_error(self, operation: str, error: Exception):
+        if self._connection is None:
+            # The cache file could not be opened at all; parse without it from now on
+            self._disabled = True
+            logger.warning(f"Page result store disabled, cannot open {self.path}: {error}")
+        else:
+            logger.warning(f"Page result store {operation} failed: {error}")
+
+# Shared by all parsers, in this process and in the parse processes
+page_result_store = PageResultStore()
@@ -1,6 +1,6 @@
 import io
 import os
-from typing import Any, Dict
+from typing import Any, Dict, List, Tuple, Union
 from fastapi import UploadFile
 from azure.core.credentials import AzureKeyCredential
 from pdfminer.high_level import extract_pages
@@ -23,8 +23,16 @@ from azure.core.credentials import AzureKeyCredential
 from azure.ai.vision.imageanalysis.models import VisualFeatures
 from functools import cache
 from .constant import DocumentType
+from .page_store import page_result_store, page_fingerprint, image_fingerprint
 import logging  
 logger = logging.getLogger(__name__)
+
+# Page classes used to route PDF pages to the cheapest adequate extractor
+PAGE_CLASS_IMAGE_ONLY = "image_only"
+PAGE_CLASS_SIMPLE = "simple"
+PAGE_CLASS_COMPLEX = "complex"
+PAGE_CLASSES = (PAGE_CLASS_IMAGE_ONLY, PAGE_CLASS_SIMPLE, PAGE_CLASS_COMPLEX)
+
 # Azure Vision API setup
 try:
     AZURE_VISION_ENDPOINT = os.environ["VISION_ENDPOINT"]
@@ -38,9 +46,65 @@ vision_client = ImageAnalysisClient(
     credential=AzureKeyCredential(AZURE_VISION_KEY)
 )
 
+def generate_image_description(image_data: bytes) -> str:
+    # Use Azure Vision API to generate description
+    try:
+        description_result = vision_client.analyze(image_data=image_data, visual_features=[VisualFeatures.CAPTION, VisualFeatures.READ])
+        caption = description_result.caption.text if description_result.caption and description_result.caption.text else "Image description unavailable"
+        ocr_text = " ".join([line.text for block in description_result.read.blocks for line in block.lines]) if description_result.read else ""
+        return f"{caption} - {ocr_text}" if ocr_text else caption
+    except Exception as e:
+        logger.error(f"Error generating image description: {e}")
+        return "Image description unavailable"
+
+def generate_image_description_from_url(image_url: str) -> str:
+    # Use Azure Vision API to generate description from URL
+    try:
+        description_result = vision_client.analyze_from_url(
+            image_url=image_url,
+            visual_features=[VisualFeatures.CAPTION, VisualFeatures.READ],
+            gender_neutral_caption=True
+        )
+        caption = description_result.caption.text if description_result.caption and description_result.caption.text else "Image description unavailable"
+        ocr_text = " ".join([line.text for block in description_result.read.blocks for line in block.lines]) if description_result.read else ""
+        return f"{caption} - OCR: {ocr_text}" if ocr_text else caption
+    except Exception as e:
+        logger.error(f"Error generating image description from URL {image_url}: {e}")
+        return "Image description unavailable"
+
+def resolve_image_descriptions(markdown: str, deferred_images: List[Tuple[str, Union[bytes, str]]]) -> str:
+    """
+    Fill in the image descriptions left out by a parser with defer_image_descriptions set.
+
+    Args:
+        markdown (str): The markdown returned by advanced_parse, with a placeholder per deferred image.
+        deferred_images (List[Tuple[str, Union[bytes, str]]]): The parser's deferred_images, pairs of
+            placeholder and image bytes or image URL.
+
+    Returns:
+        str: The markdown with every placeholder replaced by its image description.
+    """
+    for placeholder, source in deferred_images:
+        if isinstance(source, str):
+            image_description = generate_image_description_from_url(source)
+        else:
+            image_key = image_fingerprint(source)
+            image_description = page_result_store.get_description(image_key)
+            if image_description is None:
+                image_description = generate_image_description(source)
+                if not image_description.startswith("Image description unavailable"):
+                    page_result_store.put_description(image_key, image_description)
+        markdown = markdown.replace(placeholder, image_description, 1)
+    return markdown
+
 # Base parser class
 class Parser:
+    # When set, advanced_parse leaves a placeholder for every image description that needs a Vision call,
+    # so the CPU-bound parse can run apart from the I/O-bound calls (see resolve_image_descriptions)
+    defer_image_descriptions = False
+
     def __init__(self, uploadFile: UploadFile = None, bytesFile: bytes = None, path: str = None):
+        self.deferred_images = []
         if uploadFile:
             self.file = uploadFile.file.read()
         elif bytesFile:
@@ -71,6 +135,11 @@ class Parser:
     def get_document_info(self) -> Dict[str, Any]:
         raise NotImplementedError("Document info method not implemented")
 
+    def _defer_image_description(self, source: Union[bytes, str]) -> str:
+        placeholder = f"\x00image-description-{len(self.deferred_images)}\x00"
+        self.deferred_images.append((placeholder, source))
+        return placeholder
+
 class PDFParser(Parser):
     def __init__(self):
         super().__init__()
@@ -79,6 +148,10 @@ class PDFParser(Parser):
         self.font_size_threshold = 0
         self.max_text_length = 100  # Set a threshold for maximum allowed text length for headings
         self.figure_count = 0  # Track the number of figures (images)
+        self.reused_page_count = 0  # Pages whose elements came from the page result store
+        self.max_simple_blocks = 80  # Pages with more text blocks than this always get full layout analysis
+        self.page_count = 0
+        self.page_classes = {page_class: 0 for page_class in PAGE_CLASSES}
 
     def basic_parse(self) -> str:
         if len(self.elements) == 0:
@@ -93,26 +166,74 @@ class PDFParser(Parser):
         return markdown_output
 
     def collect_elements(self, include_images: bool):
-        doc_bytes = io.BytesIO(self.file)
+        pdf_document = fitz.open(stream=self.file, filetype="pdf")
         font_sizes = []
 
-        # Step 1: Extract all images using PyMuPDF if include_images is True
-        image_data_list = []
-        if include_images:
-            pdf_document = fitz.open(stream=self.file, filetype="pdf")
-            for page_num in range(len(pdf_document)):
-                page = pdf_document.load_page(page_num)
-                for img in page.get_images(full=True):
-                    xref = img[0]
-                    base_image = pdf_document.extract_image(xref)
-                    if base_image:
-                        image_bytes = base_image.get("image")
-                        if image_bytes:
-                            image_data_list.append((page_num, io.BytesIO(image_bytes)))
-
-        # Step 2: Parse PDF using pdfminer and collect text elements
-        image_counter = 0
-        for page_num, page_layout in enumerate(extract_pages(doc_bytes, laparams=LAParams())):
+        # Step 1: Reuse the results of pages whose content is unchanged since a previous upload
+        fingerprints = [page_fingerprint(pdf_document, page) for page in pdf_document]
+        page_results = {}
+        changed_pages = []
+        for page_num, fingerprint in enumerate(fingerprints):
+            cached_result = page_result_store.get_page(fingerprint, include_images)
+            if cached_result is None:
+                changed_pages.append(page_num)
+            else:
+                page_results[page_num] = cached_result
+        self.reused_page_count = len(fingerprints) - len(changed_pages)
+
+        # Step 2: Extract the changed pages only
+        if changed_pages:
+            for page_num, page_result in self._extract_page_elements(pdf_document, changed_pages, include_images).items():
+                page_results[page_num] = page_result
+                page_result_store.put_page(fingerprints[page_num], include_images, page_result)
+
+        self.page_count = len(fingerprints)
+        self.page_classes = {page_class: 0 for page_class in PAGE_CLASSES}
+        for page_num in range(len(fingerprints)):
+            page_class, elements = page_results[page_num]
+            self.page_classes[page_class] += 1
+            for element in elements:
+                if element[0] == "text":
+                    self.elements.append(element)
+                    font_sizes.append(element[1])
+                else:
+                    self.figure_count += 1
+                    self.elements.append(("image", io.BytesIO(element[1])))
+
+        # Calculate the 80th percentile font size once for all text blocks
+        if font_sizes:
+            self.font_size_threshold = np.percentile(font_sizes, 80)
+            # Determine unique top three font sizes
+            font_size_unique = list(set(font_sizes))
+            self.top_font_size = sorted(set(font_size_unique), reverse=True)[:3]
+
+    def _extract_page_elements(self, pdf_document, page_numbers, include_images: bool):
+        # Cached elements keep raw image bytes so they can be shared between parsers
+        page_results = {}
+        complex_pages = []
+        page_images = {}
+        for page_num in page_numbers:
+            page = pdf_document.load_page(page_num)
+            page_class, text_dict = self._triage_page(page)
+            page_images[page_num] = self._extract_page_images(pdf_document, page) if include_images else []
+            # Route each page to the cheapest extractor that handles its layout
+            if page_class == PAGE_CLASS_IMAGE_ONLY:
+                page_results[page_num] = (page_class, [("image", image_bytes) for _, image_bytes in page_images[page_num]])
+            elif page_class == PAGE_CLASS_SIMPLE:
+                page_results[page_num] = (page_class, self._collect_span_elements(text_dict, page_images[page_num]))
+            else:
+                complex_pages.append(page_num)
+
+        if not complex_pages:
+            return page_results
+
+        # Parse complex pages using pdfminer layout analysis and collect text elements
+        doc_bytes = io.BytesIO(self.file)
+        page_layouts = extract_pages(doc_bytes, page_numbers=complex_pages, laparams=LAParams())
+        for page_num, page_layout in zip(complex_pages, page_layouts):
+            elements = []
+            images = page_images[page_num]
+            image_counter = 0
             for element in page_layout:
                 if isinstance(element, (LTTextBox, LTTextLine)):
                     for line in element:
@@ -126,21 +247,85 @@ class PDFParser(Parser):
                                     break
 
                             if font_size:
-                                self.elements.append(("text", font_size, text_content))
-                                font_sizes.append(font_size)
+                                elements.append(("text", font_size, text_content))
                 elif isinstance(element, LTFigure) and include_images:
                     # Insert images in the correct order
-                    if image_counter < len(image_data_list) and image_data_list[image_counter][0] == page_num:
-                        self.figure_count += 1
-                        self.elements.append(("image", image_data_list[image_counter][1]))
+                    if image_counter < len(images):
+                        elements.append(("image", images[image_counter][1]))
                         image_counter += 1
+            page_results[page_num] = (PAGE_CLASS_COMPLEX, elements)
+
+        return page_results
+
+    def _triage_page(self, page):
+        # MuPDF text extraction is cheap compared to pdfminer layout analysis
+        text_dict = page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)
+        text_blocks = [block for block in text_dict["blocks"] if block.get("type") == 0 and self._block_text(block)]
+        if not text_blocks:
+            return PAGE_CLASS_IMAGE_ONLY, None
+        if len(text_blocks) > self.max_simple_blocks:
+            return PAGE_CLASS_COMPLEX, text_dict
+        for block in text_blocks:
+            for line in block["lines"]:
+                # Rotated or vertical text needs layout analysis
+                if abs(line["dir"][0] - 1) > 0.01:
+                    return PAGE_CLASS_COMPLEX, text_dict
+        if self._has_side_by_side_lines(text_blocks):
+            return PAGE_CLASS_COMPLEX, text_dict
+        return PAGE_CLASS_SIMPLE, text_dict
 
-        # Calculate the 80th percentile font size once for all text blocks
-        if font_sizes:
-            self.font_size_threshold = np.percentile(font_sizes, 80)
-            # Determine unique top three font sizes
-            font_size_unique = list(set(font_sizes))
-            self.top_font_size = sorted(set(font_size_unique), reverse=True)[:3]
+    @staticmethod
+    def _block_text(block):
+        return "".join(span["text"] for line in block["lines"] for span in line["spans"]).strip()
+
+    @staticmethod
+    def _has_side_by_side_lines(text_blocks):
+        # Lines that share a vertical band without overlapping horizontally indicate columns or tables
+        boxes = [line["bbox"] for block in text_blocks for line in block["lines"] if any(span["text"].strip() for span in line["spans"])]
+        boxes.sort(key=lambda box: box[1])
+        for i, (x0, y0, x1, y1) in enumerate(boxes):
+            for other_x0, other_y0, other_x1, other_y1 in boxes[i + 1:]:
+                if other_y0 >= y1:
+                    break
+                vertical_overlap = min(y1, other_y1) - other_y0
+                min_height = min(y1 - y0, other_y1 - other_y0)
+                if min_height > 0 and vertical_overlap > 0.5 * min_height and (x1 <= other_x0 or other_x1 <= x0):
+                    return True
+        return False
+
+    def _collect_span_elements(self, text_dict, images):
+        # Raw span extraction for single-column pages, with images placed by their vertical position
+        elements = []
+        images = sorted(images, key=lambda image: image[0])
+        image_counter = 0
+        for block in text_dict["blocks"]:
+            if block.get("type") != 0:
+                continue
+            for line in block["lines"]:
+                spans = [span for span in line["spans"] if span["text"].strip()]
+                if not spans:
+                    continue
+                while image_counter < len(images) and images[image_counter][0] <= line["bbox"][1]:
+                    elements.append(("image", images[image_counter][1]))
+                    image_counter += 1
+                text_content = "".join(span["text"] for span in line["spans"]).strip()
+                elements.append(("text", spans[0]["size"], text_content))
+        for _, image_bytes in images[image_counter:]:
+            elements.append(("image", image_bytes))
+        return elements
+
+    def _extract_page_images(self, pdf_document, page):
+        # Extract images using PyMuPDF, with the top edge of their first placement on the page
+        images = []
+        for img in page.get_images(full=True):
+            xref = img[0]
+            base_image = pdf_document.extract_image(xref)
+            if base_image:
+                image_bytes = base_image.get("image")
+                if image_bytes:
+                    rects = page.get_image_rects(xref)
+                    images.append((rects[0].y0 if rects else float("inf"), image_bytes))
+        return images
 
     def process_elements(self, include_image_descriptions: bool):
         markdown_output = []
@@ -169,23 +354,26 @@ class PDFParser(Parser):
                         logger.error("Image dimensions are out of supported range (50x50 to 16000x16000)")
                         image_description = "Image description unavailable due to unsupported dimensions"
                     else:
-                        image_description = self._generate_image_description(image_bytes)
+                        image_description = self._describe_image(image_bytes)
                     markdown_output.append(f"\n\n![Figure {image_id}] {image_description}\n")
                     image_id += 1
 
         return "\n".join(markdown_output)
 
-    @cache
+    def _describe_image(self, image_bytes):
+        # Images of unchanged pages keep their description across uploads
+        image_key = image_fingerprint(image_bytes.getvalue())
+        image_description = page_result_store.get_description(image_key)
+        if image_description is None:
+            if self.defer_image_descriptions:
+                return self._defer_image_description(image_bytes.getvalue())
+            image_description = self._generate_image_description(image_bytes)
+            if not image_description.startswith("Image description unavailable"):
+                page_result_store.put_description(image_key, image_description)
+        return image_description
+
     def _generate_image_description(self, image_bytes):
-        # Use Azure Vision API to generate description
-        try:
-            description_result = vision_client.analyze(image_data=image_bytes.getvalue(), visual_features=[VisualFeatures.CAPTION, VisualFeatures.READ])
-            caption = description_result.caption.text if description_result.caption and description_result.caption.text else "Image description unavailable"
-            ocr_text = " ".join([line.text for block in description_result.read.blocks for line in block.lines]) if description_result.read else ""
-            return f"{caption} - {ocr_text}" if ocr_text else caption
-        except Exception as e:
-            logger.error(f"Error generating image description: {e}")
-            return "Image description unavailable"
+        return generate_image_description(image_bytes.getvalue())
 
     def find_heading_candidates(self):
         heading_candidates = []
@@ -238,7 +426,10 @@ class PDFParser(Parser):
             "type": DocumentType.PDF.value,
             "word_count": word_count,
             "image_count": image_count,
-            "file_size": file_size
+            "file_size": file_size,
+            "page_count": self.page_count,
+            "page_classes": dict(self.page_classes),
+            "reused_page_count": self.reused_page_count
         }
 
 class DOCXParser(Parser):
@@ -263,7 +454,10 @@ class DOCXParser(Parser):
             elif isinstance(block, bytes):  # If the block is image bytes
                 image_bytes = io.BytesIO(block)
                 if include_image_descriptions:
-                    image_description = self._generate_image_description(image_bytes)
+                    if self.defer_image_descriptions:
+                        image_description = self._defer_image_description(block)
+                    else:
+                        image_description = self._generate_image_description(image_bytes)
                     content.append(f"\n\n![Figure {image_id}]: {image_description}\n")
                 else:
                     content.append(f"\n\n![Figure {image_id}]\n")
@@ -357,15 +551,7 @@ class DOCXParser(Parser):
 
     @cache
     def _generate_image_description(self, image_bytes):
-        # Use Azure Vision API to generate description
-        try:
-            description_result = vision_client.analyze(image_data=image_bytes.getvalue(), visual_features=[VisualFeatures.CAPTION, VisualFeatures.READ])
-            caption = description_result.caption.text if description_result.caption and description_result.caption.text else "Image description unavailable"
-            ocr_text = " ".join([line.text for block in description_result.read.blocks for line in block.lines]) if description_result.read else ""
-            return f"{caption} - {ocr_text}" if ocr_text else caption
-        except Exception as e:
-            logger.error(f"Error generating image description: {e}")
-            return "Image description unavailable"
+        return generate_image_description(image_bytes.getvalue())
 
     def get_document_info(self) -> dict:
         # Get basic information about the document
@@ -452,7 +638,10 @@ class HTMLParser(Parser):
                     image_url = base_url.rstrip('/') + '/' + image_url.lstrip('/')
                 
                 if include_image_descriptions:
-                    image_description = self._generate_image_description_from_url(image_url)
+                    if self.defer_image_descriptions:
+                        image_description = self._defer_image_description(image_url)
+                    else:
+                        image_description = self._generate_image_description_from_url(image_url)
                     markdown_content.append(f"\n\n![Image: {image_description}]\n")
                 else:
                     markdown_content.append(f"\n\n![Image]\n")
@@ -463,19 +652,7 @@ class HTMLParser(Parser):
         return "\n".join(markdown_content)
 
     def _generate_image_description_from_url(self, image_url: str) -> str:
-        # Use Azure Vision API to generate description from URL
-        try:
-            description_result = vision_client.analyze_from_url(
-                image_url=image_url,
-                visual_features=[VisualFeatures.CAPTION, VisualFeatures.READ],
-                gender_neutral_caption=True
-            )
-            caption = description_result.caption.text if description_result.caption and description_result.caption.text else "Image description unavailable"
-            ocr_text = " ".join([line.text for block in description_result.read.blocks for line in block.lines]) if description_result.read else ""
-            return f"{caption} - OCR: {ocr_text}" if ocr_text else caption
-        except Exception as e:
-            logger.error(f"Error generating image description from URL {image_url}: {e}")
-            return "Image description unavailable"
+        return generate_image_description_from_url(image_url)
         
     def get_document_info(self):
         if self.file is None:
@@ -0,0 +1,128 @@
+import io
+import os
+import re
+import zipfile
+from typing import Any, Dict
+import fitz
+
+# Cheap pre-checks applied before a document is handed to a parse worker
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+# Room for multipart boundaries and part headers when an upload is judged by its Content-Length
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+MAX_PDF_PAGES = int(os.getenv("MAX_PDF_PAGES", "2000"))
+MAX_DECOMPRESSED_BYTES = int(os.getenv("MAX_DECOMPRESSED_BYTES", str(500 * 1024 * 1024)))
+MAX_COMPRESSION_RATIO = int(os.getenv("MAX_COMPRESSION_RATIO", "200"))
+MAX_ARCHIVE_ENTRIES = int(os.getenv("MAX_ARCHIVE_ENTRIES", "10000"))
+MAX_HTML_DEPTH = int(os.getenv("MAX_HTML_DEPTH", "500"))
+# Limits enforced on every parse job while it runs
+PARSE_TIMEOUT = float(os.getenv("PARSE_TIMEOUT", "300"))
+PARSE_MAX_RSS = int(os.getenv("PARSE_MAX_RSS", str(2 * 1024 * 1024 * 1024)))
+
+# Elements that never have a closing tag and so do not increase nesting depth
+HTML_VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"}
+HTML_TAG_PATTERN = re.compile(rb"<(/?)([a-zA-Z][a-zA-Z0-9:-]*)[^>]*?(/?)>")
+# Script and style contents and comments hold no elements
+HTML_SKIPPED_PATTERN = re.compile(rb"<(script|style)\b.*?</\1\s*>|<!--.*?-->", re.IGNORECASE | re.DOTALL)
+
+class GuardrailError(Exception):
+    """Raised when a document is rejected because it exceeds a resource limit or cannot be inspected."""
+    def __init__(self, message: str, status_code: int = 413):
+        super().__init__(message)
+        self.status_code = status_code
+
+class JobLimitExceeded(GuardrailError):
+    """Raised when a parse job was terminated for exceeding its wall time or memory limit."""
+    def __init__(self, message: str):
+        super().__init__(message, status_code=422)
+
+def check_upload_size(size: int, overhead: int = 0):
+    """
+    Reject an upload by its size alone, before its content is read.
+
+    Args:
+        size (int): The size of the file, or of the whole request body.
+        overhead (int): Bytes of size that are not file content, e.g. MULTIPART_OVERHEAD_BYTES.
+
+    Raises:
+        GuardrailError: If the upload is larger than MAX_UPLOAD_BYTES.
+    """
+    if size > MAX_UPLOAD_BYTES + overhead:
+        raise GuardrailError(f"File is larger than the {MAX_UPLOAD_BYTES} byte limit")
+
+def inspect_document(file_extension: str, data: bytes) -> Dict[str, Any]:
+    """
+    Run cheap pre-checks on an upload and collect the metadata they find.
+
+    Args:
+        file_extension (str): The lower-cased file extension, e.g. ".pdf".
+        data (bytes): The uploaded file content.
+
+    Returns:
+        Dict[str, Any]: Cheap document metadata such as page_count, image_count or decompressed_size.
+
+    Raises:
+        GuardrailError: If the document exceeds a limit or is malformed.
+    """
+    check_upload_size(len(data))
+    metadata = {"file_size": len(data)}
+    if file_extension == ".pdf":
+        metadata.update(_inspect_pdf(data))
+    elif file_extension == ".docx":
+        metadata.update(_inspect_docx(data))
+    elif file_extension == ".html":
+        metadata.update(_inspect_html(data))
+    return metadata
+
+def _inspect_pdf(data: bytes) -> Dict[str, Any]:
+    try:
+        with fitz.open(stream=data, filetype="pdf") as pdf_document:
+            page_count = pdf_document.page_count
+    except Exception as e:
+        raise GuardrailError(f"Invalid PDF file: {str(e)}", status_code=400)
+    if page_count > MAX_PDF_PAGES:
+        raise GuardrailError(f"PDF has {page_count} pages, more than the {MAX_PDF_PAGES} page limit")
+    return {"page_count": page_count}
+
+def _inspect_docx(data: bytes) -> Dict[str, Any]:
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            entries = archive.infolist()
+    except zipfile.BadZipFile as e:
+        raise GuardrailError(f"Invalid DOCX file: {str(e)}", status_code=400)
+    if len(entries) > MAX_ARCHIVE_ENTRIES:
+        raise GuardrailError(f"DOCX has {len(entries)} parts, more than the {MAX_ARCHIVE_ENTRIES} part limit")
+    # zipfile never inflates an entry past its declared size, so the central directory bounds the work
+    decompressed_size = sum(entry.file_size for entry in entries)
+    if decompressed_size > MAX_DECOMPRESSED_BYTES:
+        raise GuardrailError(f"DOCX decompresses to {decompressed_size} bytes, more than the {MAX_DECOMPRESSED_BYTES} byte limit")
+    for entry in entries:
+        if entry.compress_size and entry.file_size / entry.compress_size > MAX_COMPRESSION_RATIO:
+            raise GuardrailError(f"DOCX part {entry.filename} has a suspicious compression ratio")
+    image_count = sum(1 for entry in entries if entry.filename.startswith("word/media/"))
+    return {"decompressed_size": decompressed_size, "image_count": image_count}
+
+def _inspect_html(data: bytes) -> Dict[str, Any]:
+    # Nesting is tracked the way BeautifulSoup's html.parser builder, which the HTML parser uses, builds
+    # its tree: only void and self-closing elements close implicitly, so unclosed <p> or <li> tags nest,
+    # and an end tag closes the most recent open element of that name
+    open_elements = []
+    max_depth = 0
+    image_count = 0
+    for match in HTML_TAG_PATTERN.finditer(HTML_SKIPPED_PATTERN.sub(b"", data)):
+        closing, name, self_closing = match.groups()
+        name = name.lower().decode("ascii", "ignore")
+        if closing:
+            if name in open_elements:
+                while open_elements.pop() != name:
+                    pass
+            continue
+        if name == "img":
+            image_count += 1
+        if name in HTML_VOID_ELEMENTS or self_closing:
+            continue
+        open_elements.append(name)
+        if len(open_elements) > max_depth:
+            max_depth = len(open_elements)
+            if max_depth > MAX_HTML_DEPTH:
+                raise GuardrailError(f"HTML nesting is deeper than the {MAX_HTML_DEPTH} level limit")
+    return {"max_depth": max_depth, "image_count": image_count}
@@ -1,10 +1,21 @@
+import io
 import smtplib
 import os
+import queue
+import threading
+import time
+import zipfile
+import logging
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
 
+logger = logging.getLogger(__name__)
+
+# Markdown attachments larger than this many bytes are sent zipped
+ATTACHMENT_COMPRESS_THRESHOLD = int(os.getenv("ATTACHMENT_COMPRESS_THRESHOLD", str(1024 * 1024)))
+
 class EmailSender:
     def __init__(self, recipient_email, subject, body, markdown_content, file_name, smtp_server='smtp.gmail.com', smtp_port=587):
         self.sender_email = os.getenv("SENDER_EMAIL")
@@ -35,14 +46,28 @@ class EmailSender:
         filename = self.file_name.split(".")[0] if "." in self.file_name else "content"
         # Attach the markdown content
         if self.markdown_content:
-            mime_base = MIMEBase('application', 'octet-stream')
-            mime_base.set_payload(self.markdown_content.encode('utf-8'))
+            markdown_bytes = self.markdown_content.encode('utf-8')
+            if len(markdown_bytes) > ATTACHMENT_COMPRESS_THRESHOLD:
+                mime_base = MIMEBase('application', 'zip')
+                mime_base.set_payload(self._zip_markdown(markdown_bytes, f"{filename}.md"))
+                attachment_name = f"{filename}.zip"
+            else:
+                mime_base = MIMEBase('application', 'octet-stream')
+                mime_base.set_payload(markdown_bytes)
+                attachment_name = f"{filename}.md"
             encoders.encode_base64(mime_base)
-            mime_base.add_header('Content-Disposition', f'attachment; filename="{filename}.md"')
+            mime_base.add_header('Content-Disposition', f'attachment; filename="{attachment_name}"')
             self.message.attach(mime_base)
         else:
             raise ValueError("Markdown content is empty.")
 
+    @staticmethod
+    def _zip_markdown(markdown_bytes, arcname):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr(arcname, markdown_bytes)
+        return buffer.getvalue()
+
     def send_email(self):
         # Connect to the SMTP server and send the email
         try:
@@ -52,9 +77,9 @@ class EmailSender:
             server.login(smtp_username, smtp_password)
             server.sendmail(self.sender_email, self.recipient_email, self.message.as_string())
             server.close()
-            print("Email sent successfully!")
+            logger.info("Email sent successfully!")
         except Exception as e:
-            print(f"Failed to send email. Error: {str(e)}")
+            logger.error(f"Failed to send email. Error: {str(e)}")
 
 class DeepDocEmailSender(EmailSender):
 
@@ -63,8 +88,154 @@ class DeepDocEmailSender(EmailSender):
         body = "This is the generated markdown content for your document."
         markdown_content = content
 
-        smtp_server = "smtp.gmail.com"
-        smtp_port = 587
+        smtp_server = os.getenv("SMTP_SERVER", "smtp.gmail.com")
+        smtp_port = int(os.getenv("SMTP_PORT", "587"))
 
         # Create an instance of EmailSender
         super().__init__(recipient_email, subject, body, markdown_content, file_name, smtp_server, smtp_port)
+
+
+class SMTPDeliveryWorker:
+    """
+    Background worker that delivers queued emails in batches over one pooled, authenticated
+    SMTP connection, retrying transient failures with exponential backoff.
+    """
+    def __init__(self, smtp_server, smtp_port, smtp_username=None, smtp_password=None, use_tls=True,
+                 batch_size=20, max_retries=3, retry_backoff=1.0, idle_timeout=30.0):
+        self.smtp_server = smtp_server
+        self.smtp_port = smtp_port
+        self.smtp_username = smtp_username
+        self.smtp_password = smtp_password
+        self.use_tls = use_tls
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.idle_timeout = idle_timeout
+        self.sent_count = 0
+        self.failed_count = 0
+        self._queue = queue.Queue()
+        self._connection = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="smtp-delivery", daemon=True)
+                self._thread.start()
+        return self
+
+    def submit(self, email_sender: EmailSender):
+        # The message must already be set up with setup_email
+        self._queue.put((email_sender.sender_email, email_sender.recipient_email, email_sender.message.as_string()))
+        self.start()
+
+    def join(self):
+        # Block until every submitted message was either sent or given up on
+        self._queue.join()
+
+    def stop(self, timeout=None):
+        # Messages queued before the stop are still delivered; returns False if that did not finish in time
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.warning(f"Email delivery did not finish within {timeout}s, {self._queue.qsize()} messages left undelivered")
+                return False
+        self._close_connection()
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                # Do not hold the connection open while there is nothing to send
+                self._close_connection()
+                continue
+            batch = [item]
+            while item is not None and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+
+            stopping = batch[-1] is None
+            messages = [message for message in batch if message is not None]
+            try:
+                for message in messages:
+                    self._deliver(message)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stopping:
+                self._close_connection()
+                return
+
+    def _deliver(self, message):
+        from_addr, to_addr, payload = message
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._get_connection().sendmail(from_addr, to_addr, payload)
+                self.sent_count += 1
+                logger.info(f"Email sent successfully to {to_addr}")
+                return
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPAuthenticationError) as e:
+                # Permanent failures will not succeed on retry
+                logger.error(f"Failed to send email to {to_addr}. Error: {str(e)}")
+                break
+            except (smtplib.SMTPException, OSError) as e:
+                self._close_connection()
+                if isinstance(e, smtplib.SMTPResponseException) and e.smtp_code >= 500:
+                    logger.error(f"Failed to send email to {to_addr}. Error: {str(e)}")
+                    break
+                if attempt == self.max_retries:
+                    logger.error(f"Failed to send email to {to_addr} after {attempt + 1} attempts. Error: {str(e)}")
+                    break
+                delay = self.retry_backoff * (2 ** attempt)
+                logger.warning(f"Failed to send email to {to_addr}, retrying in {delay:.1f}s. Error: {str(e)}")
+                time.sleep(delay)
+        self.failed_count += 1
+
+    def _get_connection(self):
+        if self._connection is None:
+            connection = smtplib.SMTP(self.smtp_server, self.smtp_port)
+            try:
+                if self.use_tls:
+                    connection.starttls()
+                if self.smtp_username and self.smtp_password:
+                    connection.login(self.smtp_username, self.smtp_password)
+            except Exception:
+                connection.close()
+                raise
+            self._connection = connection
+        return self._connection
+
+    def _close_connection(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                connection.quit()
+            except (smtplib.SMTPException, OSError):
+                connection.close()
+
+_delivery_worker = None
+_delivery_worker_lock = threading.Lock()
+
+def get_delivery_worker() -> SMTPDeliveryWorker:
+    # Shared worker configured from the same environment variables as EmailSender
+    global _delivery_worker
+    with _delivery_worker_lock:
+        if _delivery_worker is None:
+            _delivery_worker = SMTPDeliveryWorker(
+                smtp_server=os.getenv("SMTP_SERVER", "smtp.gmail.com"),
+                smtp_port=int(os.getenv("SMTP_PORT", "587")),
+                smtp_username=os.getenv("SMTP_USERNAME"),
+                smtp_password=os.getenv("SMTP_PASSWORD"),
+                use_tls=os.getenv("SMTP_USE_TLS", "true").lower() == "true",
+                batch_size=int(os.getenv("SMTP_BATCH_SIZE", "20")),
+                max_retries=int(os.getenv("SMTP_MAX_RETRIES", "3")),
+                retry_backoff=float(os.getenv("SMTP_RETRY_BACKOFF", "1.0")),
+            )
+        return _delivery_worker
@@ -1,16 +1,47 @@
-import threading
-from fastapi import FastAPI, File, UploadFile, HTTPException
+import asyncio
+import uuid
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, BackgroundTasks
 from fastapi.responses import JSONResponse
 from typing import List
 import os
 import logging
-from .libemail import DeepDocEmailSender
-from .convertor.parser import Parser, ParserFactory
+from .libemail import DeepDocEmailSender, get_delivery_worker
+from .convertor.parser import resolve_image_descriptions
 from .convertor.enhancer import Enhancer
+from .profiling import RequestProfiler, is_profiling_requested, file_hash
+from .workers import (convert_document, prepare_advanced_document, parse_runner, parse_scheduler, upload_limiter,
+                      email_job_limiter, UPLOAD_RETRY_AFTER)
+from .scheduler import estimate_cost
+from .results import etag_matches, not_modified_response, result_response, result_store, store_result
+from .guardrails import GuardrailError, MULTIPART_OVERHEAD_BYTES, check_upload_size, inspect_document
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# Advanced documents with more images than this are emailed instead of returned inline
+EMAIL_IMAGE_THRESHOLD = 10
+# Seconds to wait on shutdown for queued emails to be delivered
+EMAIL_SHUTDOWN_TIMEOUT = float(os.getenv("EMAIL_SHUTDOWN_TIMEOUT", "30"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    parse_runner.shutdown()
+    # The delivery thread is a daemon, so drain it here or queued emails are lost on shutdown and reload
+    await asyncio.to_thread(get_delivery_worker().stop, EMAIL_SHUTDOWN_TIMEOUT)
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    # Refuse by Content-Length before the multipart body is received and spooled
+    content_length = request.headers.get("Content-Length")
+    if request.url.path == "/upload" and content_length and content_length.isdigit():
+        try:
+            check_upload_size(int(content_length), overhead=MULTIPART_OVERHEAD_BYTES)
+        except GuardrailError as e:
+            return JSONResponse(status_code=e.status_code, content={"detail": str(e)})
+    return await call_next(request)
 
 # CORS configuration
 from fastapi.middleware.cors import CORSMiddleware
@@ -28,24 +59,47 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+async def parse_and_send_email(file_extension: str, data: bytes, file_name: str, receipient_email: str, cost: float,
+                               request_id: str = None, profile: bool = False):
+    # Holds an email_job_limiter slot, taken by upload_file, until the email is queued
+    try:
+        async with parse_scheduler.slot(cost):
+            # The CPU-bound parse runs isolated, under the same limits as every other parse job
+            content, deferred_images = await parse_runner.run(prepare_advanced_document, file_extension, data, request_id, profile)
+        # Vision, OpenAI and SMTP calls are I/O-bound and stay in the server process
+        await asyncio.to_thread(describe_and_send_email, content, deferred_images, data, file_name, receipient_email,
+                                request_id, profile)
+    except Exception as e:
+        logger.error(f"Failed to prepare the emailed result for {file_name}: {e}")
+    finally:
+        email_job_limiter.release()
+
 # Create an instance of DeepDocEmailSender with the markdown content and recipient email
-def parse_and_send_email(parser: Parser, file_name:str, receipient_email: str):    
-    content = parser.advanced_parse()
-    enhancer = Enhancer(model="gpt-3.5-turbo")
-    content = enhancer.enhance_extraction(content)
-    d = DeepDocEmailSender(content, file_name, receipient_email)
-    # Set up the email
-    d.setup_email()
-    # Send the email
-    d.send_email()
+def describe_and_send_email(content: str, deferred_images: list, data: bytes, file_name: str, receipient_email: str,
+                            request_id: str = None, profile: bool = False):
+    with RequestProfiler(request_id, "describe_and_send_email", enabled=profile) as profiler:
+        profiler.file_hash = file_hash(data)
+        content = resolve_image_descriptions(content, deferred_images)
+        enhancer = Enhancer(model="gpt-3.5-turbo")
+        content = enhancer.enhance_extraction(content)
+        d = DeepDocEmailSender(content, file_name, receipient_email)
+        # Set up the email
+        d.setup_email()
+        # Queue the email on the pooled delivery worker
+        get_delivery_worker().submit(d)
 
 @app.get("/")
 def read_root():
     return {"message": "FastAPI backend is running!"}
 
+# Queue wait times and occupancy of the parse scheduler per cost class
+@app.get("/stats/scheduler")
+def scheduler_stats():
+    return parse_scheduler.stats()
+
 # Endpoint to upload and process a document
 @app.post("/upload")
-def upload_file(file: UploadFile = File(...), advanced: bool = False, receipient_email: str = None):
+async def upload_file(request: Request, background_tasks: BackgroundTasks, file: UploadFile = File(...), advanced: bool = False, receipient_email: str = None, inline: bool = True):
     logger.info(f"Received file: {file.filename}")
     file_extension = os.path.splitext(file.filename)[1].lower()
     if advanced and not receipient_email:
@@ -55,21 +109,61 @@ def upload_file(file: UploadFile = File(...), advanced: bool = False, receipient
     if file_extension not in supported_extensions:
         raise HTTPException(status_code=400, detail="Unsupported file type")
 
+    if not upload_limiter.try_acquire():
+        raise HTTPException(status_code=429, detail="Too many uploads in progress, please retry later",
+                            headers={"Retry-After": str(UPLOAD_RETRY_AFTER)})
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    profile = is_profiling_requested(request.headers, request.query_params)
     try:
-        parser = ParserFactory.get_parser(file_extension)
-        parser.set_file(file)
-        basic_info = parser.get_document_info()
-        if advanced and ("image_count" in basic_info and basic_info["image_count"] > 10):
-            # Create a new thread to send the email
-            email_thread = threading.Thread(target=parse_and_send_email, args=(parser, file.filename, receipient_email))    
-            email_thread.start()
-
-            return JSONResponse(content={"markdown": "## The result will be sent to your email", "file_info": basic_info, "isSentEmail": True})
-        else:
-            content = parser.basic_parse()
-        
-        # Extract basic information
+        # Chunked uploads carry no Content-Length, but the spooled file's size is known before reading it
+        if file.size is not None:
+            check_upload_size(file.size)
+        data = await file.read()
+        # Reject hostile or huge documents before they reach a parse process
+        metadata = await asyncio.to_thread(inspect_document, file_extension, data)
+        # Small documents get their own worker budget so they never wait behind large ones
+        cost = estimate_cost(file_extension, metadata)
+        async with parse_scheduler.slot(cost) as job_class:
+            logger.info(f"Parsing {file.filename} as a {job_class} job (estimated cost {cost:.1f})")
+            # CPU-bound parsing runs in an isolated process so it does not contend on the GIL
+            content, basic_info = await parse_runner.run(
+                convert_document, file_extension, data, advanced, EMAIL_IMAGE_THRESHOLD, request_id, profile)
+    except GuardrailError as e:
+        logger.warning(f"Rejected file {file.filename}: {e}")
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
+    finally:
+        upload_limiter.release()
+
+    if content is None:
+        # Emailed jobs are bounded separately, since they outlive the upload request
+        if not email_job_limiter.try_acquire():
+            raise HTTPException(status_code=429, detail="Too many emailed results in progress, please retry later",
+                                headers={"Retry-After": str(UPLOAD_RETRY_AFTER)})
+        background_tasks.add_task(parse_and_send_email, file_extension, data, file.filename, receipient_email, cost,
+                                  request_id, profile)
+        return JSONResponse(content={"markdown": "## The result will be sent to your email", "file_info": basic_info, "isSentEmail": True})
+
+    # Encoding, hashing and compressing multi-megabyte results would otherwise block the event loop
+    body, digest, stored = await asyncio.to_thread(
+        store_result, {"markdown": content, "file_info": basic_info, "isSentEmail": False}, result_store)
+    # Results too large to keep are returned inline, so result_url never points at nothing
+    if not inline and stored:
+        # Clients can fetch the markdown later, and revalidate it cheaply with If-None-Match
+        return JSONResponse(content={"file_info": basic_info, "isSentEmail": False, "result_url": f"/results/{digest}"},
+                            headers={"ETag": f'"{digest}"'})
+    return await asyncio.to_thread(result_response, request, body, digest, result_store, False)
 
-    return JSONResponse(content={"markdown": content, "file_info": basic_info, "isSentEmail": False})
+# Conversion results by content hash, as returned in result_url and the ETag of /upload
+# A plain def, so Starlette runs it in its threadpool and compression stays off the event loop
+@app.get("/results/{digest}")
+def get_result(request: Request, digest: str):
+    # The digest is the content hash, so a client's copy with that tag is current even when the result was not kept
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match and if_none_match.strip() != "*" and etag_matches(if_none_match, digest):
+        return not_modified_response(digest)
+    body = result_store.get(digest)
+    if body is None:
+        raise HTTPException(status_code=404, detail="Result not found or expired")
+    return result_response(request, body, digest, result_store)
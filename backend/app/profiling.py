@@ -0,0 +1,118 @@
+import cProfile
+import hashlib
+import os
+import random
+import re
+import logging
+from typing import Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+# Profiling is opt-in: it must be enabled here and requested per call
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_DIR = os.getenv("PROFILING_DIR", "profiles")
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "1.0"))
+# Oldest profiles beyond this count are deleted after each write
+PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", "1000"))
+PROFILING_HEADER = "X-DeepDoc-Profile"
+PROFILING_QUERY_PARAM = "profile"
+
+_TRUE_VALUES = ("1", "true", "yes", "on")
+_UNSAFE_ID_CHARACTERS = re.compile(r"[^A-Za-z0-9_-]")
+MAX_ID_LENGTH = 64
+
+def file_hash(data: bytes) -> str:
+    return hashlib.sha256(data or b"").hexdigest()
+
+def safe_id(value: Optional[str]) -> str:
+    # Ids may come from request headers, so keep them to characters that are safe in a file name
+    return _UNSAFE_ID_CHARACTERS.sub("_", value or "")[:MAX_ID_LENGTH] or "request"
+
+def is_profiling_requested(headers: Mapping[str, str], query_params: Mapping[str, str]) -> bool:
+    """
+    Decide whether a request should be profiled.
+
+    Args:
+        headers (Mapping[str, str]): The request headers.
+        query_params (Mapping[str, str]): The request query parameters.
+
+    Returns:
+        bool: True when profiling is enabled, the caller asked for it and the request falls in the sample.
+    """
+    if not PROFILING_ENABLED:
+        return False
+    flag = headers.get(PROFILING_HEADER) or query_params.get(PROFILING_QUERY_PARAM) or ""
+    if flag.lower() not in _TRUE_VALUES:
+        return False
+    return random.random() < PROFILING_SAMPLE_RATE
+
+def prune_profiles(output_dir: str, max_files: int) -> int:
+    """
+    Delete the oldest pstats files in a directory so that at most max_files remain.
+
+    Args:
+        output_dir (str): The directory holding the profiles.
+        max_files (int): The number of profiles to keep.
+
+    Returns:
+        int: The number of profiles deleted.
+    """
+    profiles = []
+    for entry in os.scandir(output_dir):
+        if not entry.name.endswith(".pstats"):
+            continue
+        try:
+            profiles.append((entry.stat(follow_symlinks=False).st_mtime, entry.path))
+        except FileNotFoundError:
+            continue
+    profiles.sort(reverse=True)
+    removed = 0
+    for _, path in profiles[max(max_files, 0):]:
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            # Another worker already pruned it
+            pass
+    return removed
+
+class RequestProfiler:
+    """
+    Deterministic profiler for one stage of a request, written out as a pstats file
+    named after the request id, the uploaded file hash and the stage.
+    """
+    def __init__(self, request_id: str, stage: str, enabled: bool = True, output_dir: Optional[str] = None):
+        self.request_id = request_id
+        self.stage = stage
+        self.enabled = enabled
+        self.output_dir = output_dir or PROFILING_DIR
+        self.file_hash = None
+        self.path = None
+        self._profile = None
+
+    def __enter__(self):
+        if self.enabled:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                self._profile = profile
+            except ValueError as e:
+                # Only one profiler can be active per process on Python 3.12+
+                logger.warning(f"Skipping {self.stage} profile for request {self.request_id}: {e}")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._profile is None:
+            return False
+        self._profile.disable()
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            digest = (self.file_hash or "nohash")[:16]
+            self.path = os.path.join(self.output_dir, f"{safe_id(self.request_id)}_{digest}_{safe_id(self.stage)}.pstats")
+            self._profile.dump_stats(self.path)
+            logger.info(f"Wrote {self.stage} profile for request {self.request_id} to {self.path}")
+            prune_profiles(self.output_dir, PROFILING_MAX_FILES)
+        except OSError as e:
+            logger.error(f"Failed to write profile for request {self.request_id}: {e}")
+        # Never swallow exceptions raised by the profiled code
+        return False
@@ -0,0 +1,169 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses smaller than this are sent uncompressed
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "4096"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+# Total size of conversion results kept in memory for GET /results/{hash}; retention is opt-in
+RESULT_CACHE_BYTES = int(os.getenv("RESULT_CACHE_BYTES", "0"))
+
+def encode_result(payload: Dict[str, Any]) -> bytes:
+    # Same encoding as JSONResponse, so the hash matches the bytes that are served
+    return json.dumps(payload, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def result_hash(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()
+
+def store_result(payload: Dict[str, Any], store: "ResultStore") -> Tuple[bytes, str, bool]:
+    """
+    Encode a conversion result and offer it to the result store. Encoding and hashing a large
+    result takes a while, so call this off the event loop.
+
+    Args:
+        payload (Dict[str, Any]): The result as returned by /upload.
+        store (ResultStore): Store that keeps results for GET /results/{hash}.
+
+    Returns:
+        Tuple: The encoded body, its content hash, and whether the store kept it.
+    """
+    body = encode_result(payload)
+    digest = result_hash(body)
+    return body, digest, store.put(digest, body)
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Pick the best supported content coding from an Accept-Encoding header.
+
+    Args:
+        accept_encoding (str, optional): The Accept-Encoding request header.
+
+    Returns:
+        str: "br" or "gzip", or None when the response should not be compressed.
+    """
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.lower()] = quality
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    for coding in candidates:
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+def etag_matches(if_none_match: Optional[str], digest: str) -> bool:
+    # Weak comparison, as required for If-None-Match
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/").strip('"') == digest for tag in tags)
+
+class ResultStore:
+    """
+    LRU store of encoded conversion results keyed by content hash and bounded by total size.
+    Compressed variants are cached alongside a result the first time they are served.
+    """
+    def __init__(self, max_bytes: int = RESULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def put(self, digest: str, body: bytes) -> bool:
+        # Returns False when the result is too large to keep, so no URL may be handed out for it
+        with self._lock:
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+                return True
+            if len(body) > self.max_bytes:
+                return False
+            self._entries[digest] = {"body": body, "encoded": {}}
+            self._size += len(body)
+            self._evict()
+        return True
+
+    def get(self, digest: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            self._entries.move_to_end(digest)
+            return entry["body"]
+
+    def get_encoded(self, digest: str, body: bytes, encoding: str) -> bytes:
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and encoding in entry["encoded"]:
+                return entry["encoded"][encoding]
+        encoded = compress(body, encoding)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and encoding not in entry["encoded"]:
+                entry["encoded"][encoding] = encoded
+                self._size += len(encoded)
+                self._evict()
+        return encoded
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._size -= len(entry["body"]) + sum(len(encoded) for encoded in entry["encoded"].values())
+
+def not_modified_response(digest: str) -> Response:
+    return Response(status_code=304, headers={"ETag": f'"{digest}"', "Vary": "Accept-Encoding", "Cache-Control": "no-cache"})
+
+def result_response(request: Request, body: bytes, digest: str, store: "ResultStore", conditional: bool = True,
+                    status_code: int = 200) -> Response:
+    """
+    Build the response for a conversion result, honouring If-None-Match and Accept-Encoding.
+
+    Args:
+        request (Request): The incoming request.
+        body (bytes): The JSON-encoded result.
+        digest (str): The content hash of body, used as the ETag.
+        store (ResultStore): Store that caches compressed variants of the result.
+        conditional (bool): Whether a matching If-None-Match header yields a 304.
+        status_code (int): Status code of a full response.
+
+    Returns:
+        Response: A 304, or the result compressed when it is large enough and the client accepts it.
+    """
+    if conditional and etag_matches(request.headers.get("If-None-Match"), digest):
+        return not_modified_response(digest)
+    headers = {"ETag": f'"{digest}"', "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    encoding = negotiate_encoding(request.headers.get("Accept-Encoding")) if len(body) >= COMPRESSION_MIN_BYTES else None
+    if encoding:
+        body = store.get_encoded(digest, body, encoding)
+        # The compressed bytes differ from the identity body, so only a weak validator applies
+        headers["ETag"] = f'W/"{digest}"'
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
+
+result_store = ResultStore()
@@ -0,0 +1,151 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+JOB_CLASSES = ("small", "medium", "large")
+# Estimated cost (roughly "pages of work") up to which a job counts as small or medium
+SMALL_JOB_MAX_COST = float(os.getenv("SMALL_JOB_MAX_COST", "20"))
+MEDIUM_JOB_MAX_COST = float(os.getenv("MEDIUM_JOB_MAX_COST", "200"))
+# Recent queue waits kept per class for the stats endpoint
+WAIT_WINDOW = int(os.getenv("SCHEDULER_WAIT_WINDOW", "1000"))
+
+# Bytes of input that cost about as much to parse as one PDF page, per document type
+BYTES_PER_COST_UNIT = {".pdf": 50 * 1024, ".docx": 20 * 1024, ".html": 20 * 1024, ".csv": 50 * 1024}
+IMAGE_COST = 0.5
+
+def estimate_cost(file_extension: str, metadata: Dict[str, Any]) -> float:
+    """
+    Estimate how expensive a document is to parse from cheap pre-check metadata.
+
+    Args:
+        file_extension (str): The lower-cased file extension, e.g. ".pdf".
+        metadata (Dict[str, Any]): Metadata from inspect_document, with file_size and optionally page_count and image_count.
+
+    Returns:
+        float: The estimated cost, roughly in pages of work.
+    """
+    if "page_count" in metadata:
+        cost = float(metadata["page_count"])
+    else:
+        cost = metadata.get("file_size", 0) / BYTES_PER_COST_UNIT.get(file_extension, 50 * 1024)
+    return max(1.0, cost + IMAGE_COST * metadata.get("image_count", 0))
+
+def default_budgets(workers: int) -> Dict[str, int]:
+    # Large and medium jobs each get a quarter of the workers; small jobs always keep the rest. With fewer
+    # than three workers the classes cannot each have their own, so they share them up to the scheduler's cap
+    large = max(1, workers // 4)
+    medium = max(1, workers // 4)
+    small = workers - large - medium if workers >= 3 else workers
+    return {"small": max(1, small), "medium": medium, "large": large}
+
+def parse_budgets(value: str, workers: int) -> Dict[str, int]:
+    budgets = default_budgets(workers)
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        job_class, _, budget = item.partition("=")
+        if job_class not in budgets:
+            raise ValueError(f"Unknown job class '{job_class}', expected one of {', '.join(JOB_CLASSES)}")
+        budgets[job_class] = max(1, int(budget))
+    return budgets
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(percent / 100 * len(ordered)))]
+
+class _JobClassState:
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.running = 0
+        self.completed = 0
+        self.waiting = []
+        self.waits = deque(maxlen=WAIT_WINDOW)
+
+class CostClassScheduler:
+    """
+    Admits parse jobs by cost class. Every class has its own worker budget so that small documents
+    never queue behind large ones, and waiting jobs in a class run shortest job first. No more than
+    max_running jobs run in total; when classes compete for the last workers, cheaper classes go first.
+    """
+    def __init__(self, budgets: Dict[str, int], max_running: Optional[int] = None,
+                 small_max_cost: float = SMALL_JOB_MAX_COST, medium_max_cost: float = MEDIUM_JOB_MAX_COST):
+        self.small_max_cost = small_max_cost
+        self.medium_max_cost = medium_max_cost
+        self.max_running = max_running if max_running is not None else sum(budgets.values())
+        self.running = 0
+        self._classes = {job_class: _JobClassState(budgets[job_class]) for job_class in JOB_CLASSES}
+        self._sequence = itertools.count()
+
+    def classify(self, cost: float) -> str:
+        if cost <= self.small_max_cost:
+            return "small"
+        if cost <= self.medium_max_cost:
+            return "medium"
+        return "large"
+
+    @asynccontextmanager
+    async def slot(self, cost: float):
+        job_class = self.classify(cost)
+        state = self._classes[job_class]
+        enqueued = time.monotonic()
+        if state.running < state.budget and self.running < self.max_running and not state.waiting:
+            state.running += 1
+            self.running += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(state.waiting, (cost, next(self._sequence), waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # A slot handed over just before cancellation must be passed on
+                if waiter.done() and not waiter.cancelled():
+                    self._release(state)
+                raise
+        state.waits.append(time.monotonic() - enqueued)
+        try:
+            yield job_class
+        finally:
+            state.completed += 1
+            self._release(state)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        stats = {}
+        for job_class, state in self._classes.items():
+            waits = list(state.waits)
+            stats[job_class] = {
+                "budget": state.budget,
+                "running": state.running,
+                "waiting": sum(1 for _, _, waiter in state.waiting if not waiter.done()),
+                "completed": state.completed,
+                "wait_mean": sum(waits) / len(waits) if waits else 0.0,
+                "wait_p50": _percentile(waits, 50),
+                "wait_p95": _percentile(waits, 95),
+                "wait_max": max(waits, default=0.0),
+            }
+        return stats
+
+    def _release(self, state: _JobClassState):
+        state.running -= 1
+        self.running -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        # Hand free slots to the cheapest waiting job of the cheapest class that is within its budget
+        while self.running < self.max_running:
+            if not any(state.running < state.budget and self._start_waiter(state) for state in self._classes.values()):
+                return
+
+    def _start_waiter(self, state: _JobClassState) -> bool:
+        while state.waiting:
+            _, _, waiter = heapq.heappop(state.waiting)
+            if not waiter.done():
+                waiter.set_result(None)
+                state.running += 1
+                self.running += 1
+                return True
+        return False
@@ -0,0 +1,211 @@
+import asyncio
+import io
+import os
+import multiprocessing
+import resource
+import threading
+import time
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from .convertor.parser import ParserFactory
+from .guardrails import JobLimitExceeded, PARSE_TIMEOUT, PARSE_MAX_RSS
+from .profiling import RequestProfiler, file_hash
+from .scheduler import CostClassScheduler, parse_budgets
+
+logger = logging.getLogger(__name__)
+
+# Number of parse processes allowed to run at once
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))
+# Uploads accepted at once (parsing or waiting for a worker) before answering 429
+MAX_CONCURRENT_UPLOADS = int(os.getenv("MAX_CONCURRENT_UPLOADS", str(PARSE_WORKERS * 4)))
+# Advanced uploads accepted for email delivery and not yet queued on the delivery worker
+MAX_PENDING_EMAIL_JOBS = int(os.getenv("MAX_PENDING_EMAIL_JOBS", str(MAX_CONCURRENT_UPLOADS)))
+# Seconds clients are asked to wait before retrying a rejected upload
+UPLOAD_RETRY_AFTER = int(os.getenv("UPLOAD_RETRY_AFTER", "5"))
+
+def _current_rss(pid: int) -> Optional[int]:
+    # Resident set size in bytes, read from /proc where available
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        return None
+    return None
+
+def _peak_rss() -> int:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _run_job(conn, fn: Callable, args: tuple, max_rss: int):
+    # Entry point of an isolated parse process
+    try:
+        result = fn(*args)
+        if _peak_rss() > max_rss:
+            conn.send(("limit", f"Parsing exceeded the {max_rss} byte memory limit"))
+        else:
+            conn.send(("ok", result))
+    except MemoryError:
+        conn.send(("limit", f"Parsing exceeded the {max_rss} byte memory limit"))
+    except Exception as e:
+        conn.send(("error", str(e)))
+    finally:
+        conn.close()
+
+class IsolatedJobRunner:
+    """
+    Runs every parse job in its own short-lived process, forked from a server process that has
+    the parsers preloaded, and kills it when it exceeds the wall time or memory limit. A job that
+    goes wrong only ever takes down its own process.
+    """
+    def __init__(self, max_workers: int, timeout: float, max_rss: int, poll_interval: float = 0.05):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_rss = max_rss
+        self.poll_interval = poll_interval
+        self._context = multiprocessing.get_context("forkserver")
+        self._context.set_forkserver_preload([__name__])
+        self._processes = set()
+        self._slots = None
+        self._slots_loop = None
+
+    async def run(self, fn: Callable, *args):
+        async with self._get_slots():
+            cancelled = threading.Event()
+            job = asyncio.ensure_future(asyncio.to_thread(self._run_in_process, fn, args, cancelled))
+            try:
+                return await asyncio.shield(job)
+            except asyncio.CancelledError:
+                # Keep the slot, and with it the caller's scheduler slot, until the process is reaped,
+                # or cancelled requests would let more than max_workers processes run at once
+                cancelled.set()
+                while not job.done():
+                    try:
+                        await asyncio.shield(job)
+                    except BaseException:
+                        pass
+                raise
+
+    def shutdown(self):
+        for process in list(self._processes):
+            process.kill()
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots_loop is not loop:
+            self._slots = asyncio.Semaphore(self.max_workers)
+            self._slots_loop = loop
+        return self._slots
+
+    def _run_in_process(self, fn: Callable, args: tuple, cancelled: Optional[threading.Event] = None):
+        reader, writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_run_job, args=(writer, fn, args, self.max_rss), daemon=True)
+        process.start()
+        writer.close()
+        self._processes.add(process)
+        started = time.monotonic()
+        try:
+            while True:
+                if reader.poll(self.poll_interval):
+                    try:
+                        status, payload = reader.recv()
+                    except EOFError:
+                        raise RuntimeError(f"Parse worker exited unexpectedly with code {process.exitcode}")
+                    if status == "ok":
+                        return payload
+                    if status == "limit":
+                        raise JobLimitExceeded(payload)
+                    raise RuntimeError(payload)
+                if cancelled is not None and cancelled.is_set():
+                    raise RuntimeError("Parse job was cancelled")
+                elapsed = time.monotonic() - started
+                if elapsed > self.timeout:
+                    raise JobLimitExceeded(f"Parsing exceeded the {self.timeout:g}s time limit")
+                rss = _current_rss(process.pid)
+                if rss is not None and rss > self.max_rss:
+                    raise JobLimitExceeded(f"Parsing exceeded the {self.max_rss} byte memory limit")
+        except JobLimitExceeded as e:
+            logger.warning(f"Terminated parse job {process.pid} after {time.monotonic() - started:.1f}s: {e}")
+            raise
+        finally:
+            if process.is_alive():
+                process.kill()
+            process.join()
+            reader.close()
+            self._processes.discard(process)
+
+# Worker budgets per cost class, e.g. "small=4,medium=2,large=1"; defaults split PARSE_WORKERS
+parse_budget = parse_budgets(os.getenv("SCHEDULER_BUDGETS", ""), PARSE_WORKERS)
+# Budgets cap each class, PARSE_WORKERS caps them all
+parse_scheduler = CostClassScheduler(parse_budget, PARSE_WORKERS)
+parse_runner = IsolatedJobRunner(PARSE_WORKERS, PARSE_TIMEOUT, PARSE_MAX_RSS)
+
+def convert_document(file_extension: str, data: bytes, advanced: bool, email_image_threshold: int,
+                     request_id: Optional[str] = None, profile: bool = False) -> Tuple[Optional[str], Dict[str, Any]]:
+    """
+    Parse an uploaded document. Runs in an isolated parse process.
+
+    Args:
+        file_extension (str): The lower-cased file extension, e.g. ".pdf".
+        data (bytes): The uploaded file content.
+        advanced (bool): Whether advanced processing was requested.
+        email_image_threshold (int): Advanced documents with more images than this are emailed instead of parsed inline.
+        request_id (str, optional): Request id used to name the profile.
+        profile (bool): Whether to profile this job.
+
+    Returns:
+        Tuple: The basic markdown, or None when the result will be emailed, and the document info.
+    """
+    with RequestProfiler(request_id, "convert_document", enabled=profile) as profiler:
+        profiler.file_hash = file_hash(data)
+        parser = ParserFactory.get_parser(file_extension)
+        parser.set_file(bytesFile=io.BytesIO(data))
+        basic_info = parser.get_document_info()
+        if advanced and basic_info.get("image_count", 0) > email_image_threshold:
+            # The advanced parse runs later as its own job, see prepare_advanced_document
+            return None, basic_info
+        return parser.basic_parse(), basic_info
+
+def prepare_advanced_document(file_extension: str, data: bytes, request_id: Optional[str] = None,
+                              profile: bool = False) -> Tuple[str, List[Tuple[str, Union[bytes, str]]]]:
+    """
+    Run the CPU-bound part of an advanced parse. Runs in an isolated parse process.
+
+    Args:
+        file_extension (str): The lower-cased file extension, e.g. ".pdf".
+        data (bytes): The uploaded file content.
+        request_id (str, optional): Request id used to name the profile.
+        profile (bool): Whether to profile this job.
+
+    Returns:
+        Tuple: The advanced markdown with image description placeholders, and the images to describe,
+        for resolve_image_descriptions.
+    """
+    with RequestProfiler(request_id, "prepare_advanced_document", enabled=profile) as profiler:
+        profiler.file_hash = file_hash(data)
+        parser = ParserFactory.get_parser(file_extension)
+        parser.set_file(bytesFile=io.BytesIO(data))
+        parser.defer_image_descriptions = True
+        return parser.advanced_parse(), parser.deferred_images
+
+class ConcurrencyLimiter:
+    """
+    Non-blocking admission counter for the event loop; callers that cannot acquire a slot
+    should be turned away instead of queued.
+    """
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+
+    def try_acquire(self) -> bool:
+        if self.active >= self.limit:
+            return False
+        self.active += 1
+        return True
+
+    def release(self):
+        self.active = max(0, self.active - 1)
+
+upload_limiter = ConcurrencyLimiter(MAX_CONCURRENT_UPLOADS)
+email_job_limiter = ConcurrencyLimiter(MAX_PENDING_EMAIL_JOBS)
@@ -0,0 +1,77 @@
+import io
+from typing import Callable, Dict, Tuple
+from docx import Document
+from PIL import Image
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+# Advanced uploads with more images than the server's email threshold go through the email path
+MANY_IMAGES = 12
+PARAGRAPH = "DeepDoc load test paragraph with enough words to look like real running text. " * 4
+
+# Every factory takes a variant; documents of different variants share no page, image or URL, so
+# uploads never hit the server's page and image description caches unless they reuse a variant
+
+def _image(index: int, variant: int = 0) -> Image.Image:
+    image = Image.new("RGB", (120, 120), ((index * 40) % 256, (index * 90) % 256, (index * 150) % 256))
+    image.putpixel((0, 0), tuple(variant.to_bytes(3, "big")))
+    return image
+
+def make_pdf(pages: int = 5, images: int = 0, variant: int = 0) -> bytes:
+    pdf_buffer = io.BytesIO()
+    c = canvas.Canvas(pdf_buffer)
+    for page in range(pages):
+        c.setFont("Helvetica-Bold", 18)
+        c.drawString(72, 780, f"{page + 1} Section {page + 1}")
+        c.setFont("Helvetica", 8)
+        c.drawString(72, 60, f"Document {variant}")
+        c.setFont("Helvetica", 10)
+        for line in range(40):
+            c.drawString(72, 750 - 16 * line, f"{line}: {PARAGRAPH[:90]}")
+        c.showPage()
+    for index in range(images):
+        c.drawImage(ImageReader(_image(index, variant)), 72, 500, 120, 120)
+        c.drawString(72, 480, f"Figure {index + 1} of document {variant}")
+        c.showPage()
+    c.save()
+    return pdf_buffer.getvalue()
+
+def make_docx(paragraphs: int = 50, images: int = 0, variant: int = 0) -> bytes:
+    doc = Document()
+    doc.add_heading(f"DeepDoc load test document {variant}", level=1)
+    for index in range(paragraphs):
+        if index % 10 == 0:
+            doc.add_heading(f"Section {index // 10 + 1}", level=2)
+        doc.add_paragraph(PARAGRAPH)
+    for index in range(images):
+        image_buffer = io.BytesIO()
+        _image(index, variant).save(image_buffer, format="PNG")
+        image_buffer.seek(0)
+        doc.add_picture(image_buffer)
+    docx_buffer = io.BytesIO()
+    doc.save(docx_buffer)
+    return docx_buffer.getvalue()
+
+def make_csv(rows: int = 1000, variant: int = 0) -> bytes:
+    lines = ["id,name,value"] + [f"{row},item {row} of document {variant},{row * 1.5}" for row in range(rows)]
+    return "\n".join(lines).encode("utf-8")
+
+def make_html(sections: int = 20, images: int = 0, variant: int = 0) -> bytes:
+    body = []
+    for index in range(sections):
+        body.append(f"<h2>Section {index + 1}</h2><p>{PARAGRAPH}</p><ul><li>first</li><li>second</li></ul>")
+    for index in range(images):
+        body.append(f'<img src="https://example.com/loadtest/{variant}/{index}.png">')
+    return f"<html><head><title>Load test document {variant}</title></head><body>{''.join(body)}</body></html>".encode("utf-8")
+
+# Document kinds the harness can mix, as (file name, factory taking the variant)
+DOCUMENT_KINDS: Dict[str, Tuple[str, Callable[[int], bytes]]] = {
+    "pdf": ("loadtest.pdf", lambda variant: make_pdf(pages=5, variant=variant)),
+    "pdf_large": ("loadtest_large.pdf", lambda variant: make_pdf(pages=100, variant=variant)),
+    "pdf_images": ("loadtest_images.pdf", lambda variant: make_pdf(pages=2, images=MANY_IMAGES, variant=variant)),
+    "docx": ("loadtest.docx", lambda variant: make_docx(variant=variant)),
+    "docx_images": ("loadtest_images.docx", lambda variant: make_docx(images=MANY_IMAGES, variant=variant)),
+    "csv": ("loadtest.csv", lambda variant: make_csv(variant=variant)),
+    "html": ("loadtest.html", lambda variant: make_html(variant=variant)),
+    "html_images": ("loadtest_images.html", lambda variant: make_html(images=MANY_IMAGES, variant=variant)),
+}
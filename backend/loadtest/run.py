@@ -0,0 +1,281 @@
+"""
+Load-test harness for the DeepDoc backend.
+
+Starts local stand-ins for Azure Vision, OpenAI chat completions and SMTP, points the backend at
+them, drives /upload with a configurable mix of documents and concurrency, and reports throughput,
+latency percentiles, time to email delivery for emailed results and an error breakdown.
+
+Example:
+    cd backend
+    python -m loadtest.run --requests 500 --concurrency 16 --mix pdf=4,docx=2,csv=1,html=1 --advanced-ratio 0.2
+
+Every upload sends a document of its own and the started backend keeps no page cache, so the numbers
+reflect cold work. --warm-cache instead repeats one document per kind against a temporary page cache.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+import httpx
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+from .documents import DOCUMENT_KINDS
+from .stand_ins import ChatCompletionsStandIn, VisionStandIn
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+class DiscardingSMTPHandler:
+    def __init__(self):
+        self.received = 0
+        # Arrival time per recipient, which is unique per upload
+        self.arrivals = {}
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received += 1
+        for recipient in envelope.rcpt_tos:
+            self.arrivals[recipient] = time.monotonic()
+        return "250 Message accepted for delivery"
+
+    def wait_for(self, count: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while self.received < count:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for item in mix.split(","):
+        kind, _, weight = item.partition("=")
+        kind = kind.strip()
+        if kind not in DOCUMENT_KINDS:
+            raise ValueError(f"Unknown document kind '{kind}', expected one of {', '.join(DOCUMENT_KINDS)}")
+        weights[kind] = float(weight or 1)
+    return weights
+
+def percentile(values: List[float], percent: float) -> float:
+    # Nearest-rank percentile
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def start_backend(port: int, env: Dict[str, str]) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env={**os.environ, **env})
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited with code {process.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Backend did not start within 60s")
+
+async def drive(target: str, documents: Dict[str, tuple], weights: Dict[str, float], requests: int,
+                duration: Optional[float], concurrency: int, advanced_ratio: float, timeout: float, seed: int,
+                warm_cache: bool = False) -> Tuple[List[dict], float]:
+    rng = random.Random(seed)
+    kinds, kind_weights = list(weights), list(weights.values())
+    results = []
+    issued = 0
+    deadline = time.monotonic() + duration if duration else None
+    # A warm-cache run sends the same document of each kind every time
+    warm_documents = {kind: factory(0) for kind, (_, factory) in documents.items()} if warm_cache else {}
+
+    def next_request():
+        nonlocal issued
+        if (deadline is not None and time.monotonic() >= deadline) or (deadline is None and issued >= requests):
+            return None
+        issued += 1
+        return issued, rng.choices(kinds, kind_weights)[0], rng.random() < advanced_ratio
+
+    async def worker(client: httpx.AsyncClient):
+        while True:
+            request = next_request()
+            if request is None:
+                return
+            number, kind, advanced = request
+            file_name, factory = documents[kind]
+            # Built off the event loop so that generating a document does not hold up other uploads
+            data = warm_documents[kind] if warm_cache else await asyncio.to_thread(factory, number)
+            params = {"advanced": str(advanced).lower()}
+            recipient = f"loadtest+{number}@example.com" if advanced else None
+            if advanced:
+                params["receipient_email"] = recipient
+            started_at = time.monotonic()
+            started = time.perf_counter()
+            emailed = False
+            try:
+                response = await client.post(f"{target}/upload", params=params, files={"file": (file_name, data)})
+                error = None if response.status_code < 400 else f"HTTP {response.status_code}"
+                status = response.status_code
+                emailed = error is None and advanced and response.json().get("isSentEmail", False)
+            except httpx.HTTPError as e:
+                error, status = type(e).__name__, None
+            results.append({"kind": kind, "advanced": advanced, "status": status, "error": error,
+                            "latency": time.perf_counter() - started, "started_at": started_at,
+                            "recipient": recipient, "emailed": emailed})
+
+    async with httpx.AsyncClient(timeout=timeout, limits=httpx.Limits(max_connections=concurrency)) as client:
+        started = time.monotonic()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+    return results, elapsed
+
+def summarize(results: List[dict], elapsed: float, arrivals: Optional[Dict[str, float]] = None) -> dict:
+    def latency_summary(items, latencies=None, errors=None):
+        latencies = [item["latency"] for item in items] if latencies is None else latencies
+        return {"count": len(items), "errors": sum(1 for item in items if item["error"]) if errors is None else errors,
+                "p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99), "max": max(latencies, default=0.0)}
+
+    by_kind = defaultdict(list)
+    for item in results:
+        by_kind[item["kind"] + (" (advanced)" if item["advanced"] else "")].append(item)
+    successes = sum(1 for item in results if not item["error"])
+    # Time from sending the upload until its email reached the SMTP stand-in; undelivered emails count as errors
+    emailed = [item for item in results if item.get("emailed")]
+    delivered = [arrivals[item["recipient"]] - item["started_at"] for item in emailed if item["recipient"] in (arrivals or {})]
+    return {
+        "requests": len(results),
+        "elapsed": elapsed,
+        "throughput": len(results) / elapsed if elapsed else 0.0,
+        "successful_throughput": successes / elapsed if elapsed else 0.0,
+        "latency": latency_summary(results),
+        "by_kind": {kind: latency_summary(items) for kind, items in sorted(by_kind.items())},
+        "email_delivery": latency_summary(emailed, delivered, len(emailed) - len(delivered)),
+        "errors": dict(Counter(item["error"] for item in results if item["error"])),
+    }
+
+def print_report(report: dict):
+    if report.get("warm_cache"):
+        print("Warm cache: documents repeat, so unchanged pages and images were served from the page cache")
+    print(f"Requests: {report['requests']} in {report['elapsed']:.1f}s "
+          f"({report['throughput']:.2f} req/s, {report['successful_throughput']:.2f} successful req/s)")
+    header = f"{'kind':<26}{'count':>7}{'errors':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+    print(header)
+    print("-" * len(header))
+    rows = [("all", report["latency"])] + list(report["by_kind"].items())
+    if report["email_delivery"]["count"]:
+        rows.append(("time to email", report["email_delivery"]))
+    for kind, summary in rows:
+        print(f"{kind:<26}{summary['count']:>7}{summary['errors']:>8}{summary['p50']:>9.3f}"
+              f"{summary['p95']:>9.3f}{summary['p99']:>9.3f}{summary['max']:>9.3f}")
+    if report["errors"]:
+        print("Errors:")
+        for error, count in sorted(report["errors"].items(), key=lambda item: -item[1]):
+            print(f"  {error}: {count}")
+    for service, stats in report.get("stand_ins", {}).items():
+        print(f"{service}: {stats}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the DeepDoc /upload endpoint against local stand-ins.")
+    parser.add_argument("--target", help="URL of an already running backend; by default one is started against the stand-ins")
+    parser.add_argument("--requests", type=int, default=200, help="Total number of uploads to send")
+    parser.add_argument("--duration", type=float, help="Send uploads for this many seconds instead of a fixed count")
+    parser.add_argument("--concurrency", type=int, default=8, help="Uploads in flight at once")
+    parser.add_argument("--mix", default="pdf=4,docx=2,csv=1,html=1", help=f"Weighted document kinds from: {', '.join(DOCUMENT_KINDS)}")
+    parser.add_argument("--advanced-ratio", type=float, default=0.0, help="Fraction of uploads sent with advanced=true")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--parse-workers", type=int, help="PARSE_WORKERS for the started backend")
+    for service, latency in (("vision", 0.5), ("openai", 1.5)):
+        parser.add_argument(f"--{service}-latency", type=float, default=latency, help=f"Seconds of latency for the {service} stand-in")
+        parser.add_argument(f"--{service}-jitter", type=float, default=0.2, help=f"Maximum random extra latency for the {service} stand-in")
+        parser.add_argument(f"--{service}-error-rate", type=float, default=0.0, help=f"Fraction of {service} requests that fail with 500")
+        parser.add_argument(f"--{service}-rate-limit", type=float, help=f"Requests per second the {service} stand-in accepts before 429")
+    parser.add_argument("--warm-cache", action="store_true",
+                        help="Repeat one document per kind and let the started backend cache pages in a temporary file")
+    parser.add_argument("--email-timeout", type=float, default=300.0, help="Seconds to wait for emailed results after the last upload")
+    parser.add_argument("--json", help="Also write the report as JSON to this path")
+    args = parser.parse_args(argv)
+
+    weights = parse_mix(args.mix)
+    documents = {kind: DOCUMENT_KINDS[kind] for kind in weights}
+    # Never share the page cache of a local development server
+    cache_dir = tempfile.mkdtemp(prefix="deepdoc-loadtest-") if args.warm_cache else None
+
+    vision = VisionStandIn(args.vision_latency, args.vision_jitter, args.vision_error_rate, args.vision_rate_limit).start()
+    openai_stand_in = ChatCompletionsStandIn(args.openai_latency, args.openai_jitter, args.openai_error_rate, args.openai_rate_limit).start()
+    smtp_handler = DiscardingSMTPHandler()
+    smtp_port = _free_port()
+    smtp = Controller(smtp_handler, hostname="127.0.0.1", port=smtp_port,
+                      authenticator=lambda *args: AuthResult(success=True), auth_require_tls=False)
+    smtp.start()
+    backend = None
+    try:
+        target = args.target
+        if not target:
+            port = _free_port()
+            env = {
+                "VISION_ENDPOINT": vision.url,
+                "VISION_KEY": "loadtest",
+                "OPENAPI_KEY": "loadtest",
+                "OPENAI_BASE_URL": f"{openai_stand_in.url}/v1",
+                "SENDER_EMAIL": "deepdoc@example.com",
+                "SMTP_SERVER": "127.0.0.1",
+                "SMTP_PORT": str(smtp_port),
+                "SMTP_USE_TLS": "false",
+                "SMTP_USERNAME": "loadtest",
+                "SMTP_PASSWORD": "loadtest",
+                "PAGE_CACHE_PATH": os.path.join(cache_dir, "page-cache.sqlite3") if cache_dir else "",
+            }
+            if args.parse_workers:
+                env["PARSE_WORKERS"] = str(args.parse_workers)
+            backend = start_backend(port, env)
+            target = f"http://127.0.0.1:{port}"
+        else:
+            print(f"Point the backend at VISION_ENDPOINT={vision.url} OPENAI_BASE_URL={openai_stand_in.url}/v1 "
+                  f"SMTP_SERVER=127.0.0.1 SMTP_PORT={smtp_port} SMTP_USE_TLS=false")
+
+        results, elapsed = asyncio.run(drive(target, documents, weights, args.requests, args.duration,
+                                             args.concurrency, args.advanced_ratio, args.timeout, args.seed,
+                                             args.warm_cache))
+        emailed = sum(1 for item in results if item["emailed"])
+        if emailed and not smtp_handler.wait_for(emailed, args.email_timeout):
+            print(f"Only {smtp_handler.received} of {emailed} emails arrived within {args.email_timeout:g}s")
+        report = summarize(results, elapsed, dict(smtp_handler.arrivals))
+        report["warm_cache"] = args.warm_cache
+        report["stand_ins"] = {"vision": dict(vision.stats), "openai": dict(openai_stand_in.stats),
+                               "smtp": {"received": smtp_handler.received}}
+    finally:
+        if backend is not None:
+            backend.terminate()
+            backend.wait(timeout=30)
+        smtp.stop()
+        vision.stop()
+        openai_stand_in.stop()
+        if cache_dir:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+    return report
+
+if __name__ == "__main__":
+    main()
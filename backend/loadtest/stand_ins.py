@@ -0,0 +1,144 @@
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+class StandInServer:
+    """
+    Local HTTP server emulating a remote API with configurable latency, error rate and rate limit.
+
+    Args:
+        latency (float): Seconds added to every response.
+        jitter (float): Maximum extra seconds added at random to every response.
+        error_rate (float): Fraction of requests answered with a 500.
+        rate_limit (float, optional): Requests per second accepted before answering 429.
+        host (str): Interface to listen on.
+        port (int): Port to listen on, 0 picks a free one.
+    """
+    service = "stand-in"
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit: Optional[float] = None, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.stats = {"requests": 0, "ok": 0, "errors": 0, "rate_limited": 0}
+        self._lock = threading.Lock()
+        self._tokens = rate_limit or 0.0
+        self._last_refill = time.monotonic()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name=self.service, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def handle(self, path: str, body: bytes) -> Optional[Dict]:
+        # Return the JSON body for a supported path, or None for a 404
+        raise NotImplementedError("Stand-in servers must implement handle")
+
+    def _admit(self) -> Optional[int]:
+        # Decide the fate of a request: None to serve it, otherwise the status code to fail with
+        with self._lock:
+            self.stats["requests"] += 1
+            if self.rate_limit:
+                now = time.monotonic()
+                self._tokens = min(self.rate_limit, self._tokens + (now - self._last_refill) * self.rate_limit)
+                self._last_refill = now
+                if self._tokens < 1:
+                    self.stats["rate_limited"] += 1
+                    return 429
+                self._tokens -= 1
+            if random.random() < self.error_rate:
+                self.stats["errors"] += 1
+                return 500
+            self.stats["ok"] += 1
+            return None
+
+    def _make_handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                time.sleep(stand_in.latency + random.uniform(0, stand_in.jitter))
+                status = stand_in._admit()
+                if status == 429:
+                    self._send_json(429, {"error": {"code": "429", "message": "Rate limit exceeded"}}, {"Retry-After": "1"})
+                    return
+                if status == 500:
+                    self._send_json(500, {"error": {"code": "InternalServerError", "message": "Injected failure"}})
+                    return
+                payload = stand_in.handle(self.path, body)
+                if payload is None:
+                    self._send_json(404, {"error": {"code": "NotFound", "message": f"Unknown path {self.path}"}})
+                else:
+                    self._send_json(200, payload)
+
+            def _send_json(self, status, payload, headers=None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+class VisionStandIn(StandInServer):
+    """Emulates the Azure AI Vision Image Analysis 4.0 analyze endpoint used by ImageAnalysisClient."""
+    service = "vision-stand-in"
+
+    def handle(self, path: str, body: bytes) -> Optional[Dict]:
+        if "imageanalysis:analyze" not in path:
+            return None
+        polygon = [{"x": 0, "y": 0}, {"x": 100, "y": 0}, {"x": 100, "y": 20}, {"x": 0, "y": 20}]
+        return {
+            "modelVersion": "2023-10-01",
+            "metadata": {"width": 200, "height": 200},
+            "captionResult": {"text": "a placeholder image from the load test", "confidence": 0.9},
+            "readResult": {"blocks": [{"lines": [{
+                "text": "LOAD TEST",
+                "boundingPolygon": polygon,
+                "words": [{"text": "LOAD", "boundingPolygon": polygon, "confidence": 0.99},
+                          {"text": "TEST", "boundingPolygon": polygon, "confidence": 0.99}],
+            }]}]},
+        }
+
+class ChatCompletionsStandIn(StandInServer):
+    """Emulates the OpenAI chat completions endpoint used by Enhancer."""
+    service = "openai-stand-in"
+
+    def handle(self, path: str, body: bytes) -> Optional[Dict]:
+        if not path.rstrip("/").endswith("/chat/completions"):
+            return None
+        request = json.loads(body or b"{}")
+        prompt = request.get("messages", [{}])[-1].get("content", "")
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stand-in"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": prompt}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt.split()), "completion_tokens": len(prompt.split()), "total_tokens": 2 * len(prompt.split())},
+        }
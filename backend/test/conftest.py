@@ -0,0 +1,11 @@
+import os
+import shutil
+import tempfile
+
+# Parse jobs run in forkserver children that open the page cache named by the environment,
+# so point it at a throwaway directory before any test imports the app
+PAGE_CACHE_DIR = tempfile.mkdtemp(prefix="deepdoc-test-")
+os.environ["PAGE_CACHE_PATH"] = os.path.join(PAGE_CACHE_DIR, "page-cache.sqlite3")
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(PAGE_CACHE_DIR, ignore_errors=True)
@@ -0,0 +1,90 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import io
+import zipfile
+import pytest
+from docx import Document
+from reportlab.pdfgen import canvas
+from app import guardrails
+from app.guardrails import GuardrailError, inspect_document
+
+@pytest.fixture
+def sample_pdf():
+    pdf_buffer = io.BytesIO()
+    c = canvas.Canvas(pdf_buffer)
+    for i in range(3):
+        c.drawString(100, 750, f"Page {i}")
+        c.showPage()
+    c.save()
+    return pdf_buffer.getvalue()
+
+@pytest.fixture
+def sample_docx():
+    docx_content = io.BytesIO()
+    doc = Document()
+    doc.add_heading('Hello, World!', level=1)
+    doc.save(docx_content)
+    return docx_content.getvalue()
+
+def test_inspect_pdf_page_count(sample_pdf, monkeypatch):
+    assert inspect_document(".pdf", sample_pdf)["page_count"] == 3
+    monkeypatch.setattr(guardrails, "MAX_PDF_PAGES", 2)
+    with pytest.raises(GuardrailError, match="page limit"):
+        inspect_document(".pdf", sample_pdf)
+
+def test_inspect_invalid_pdf():
+    with pytest.raises(GuardrailError) as error:
+        inspect_document(".pdf", b"not a pdf")
+    assert error.value.status_code == 400
+
+def test_inspect_upload_size(monkeypatch):
+    monkeypatch.setattr(guardrails, "MAX_UPLOAD_BYTES", 10)
+    with pytest.raises(GuardrailError, match="byte limit"):
+        inspect_document(".csv", b"a,b\n" * 10)
+
+def test_inspect_docx(sample_docx):
+    metadata = inspect_document(".docx", sample_docx)
+    assert metadata["decompressed_size"] > 0
+    assert metadata["image_count"] == 0
+
+def test_inspect_docx_zip_bomb():
+    bomb = io.BytesIO()
+    with zipfile.ZipFile(bomb, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("word/document.xml", b"\0" * (20 * 1024 * 1024))
+    with pytest.raises(GuardrailError, match="compression ratio"):
+        inspect_document(".docx", bomb.getvalue())
+
+def test_inspect_html_depth(monkeypatch):
+    monkeypatch.setattr(guardrails, "MAX_HTML_DEPTH", 50)
+    shallow = b"<html><body><ul><li>one<li>two</ul><p>text<br><img src='a.png'></body></html>"
+    assert inspect_document(".html", shallow)["image_count"] == 1
+    deep = b"<div>" * 100 + b"</div>" * 100
+    with pytest.raises(GuardrailError, match="nesting"):
+        inspect_document(".html", deep)
+
+def test_inspect_html_counts_unclosed_elements(monkeypatch):
+    # html.parser nests unclosed <p> and <li> tags, so they must count towards the depth
+    monkeypatch.setattr(guardrails, "MAX_HTML_DEPTH", 50)
+    assert inspect_document(".html", b"<p>x</p>" * 100)["max_depth"] == 1
+    assert inspect_document(".html", b"<div/>" * 100 + b"<script><div><div></script><!-- <div> -->")["max_depth"] == 0
+    for deep in (b"<p>x" * 100, b"<li>x" * 100, b"<table><tr><td>x" * 40):
+        with pytest.raises(GuardrailError, match="nesting"):
+            inspect_document(".html", deep)
+
+def test_oversized_upload_is_rejected_before_reading(monkeypatch):
+    from fastapi.testclient import TestClient
+    from app.main import app
+    monkeypatch.setattr(guardrails, "MAX_UPLOAD_BYTES", 1024)
+    monkeypatch.setattr("app.main.MULTIPART_OVERHEAD_BYTES", 0)
+    client = TestClient(app)
+    # By Content-Length, before the body is parsed; the endpoint itself would answer 400 for this extension
+    response = client.post("/upload", files={"file": ("report.txt", b"a,b\n" * 1024)})
+    assert response.status_code == 413
+    # By the spooled file size, when the body is sent without a Content-Length
+    def chunks():
+        yield b"--x\r\nContent-Disposition: form-data; name=\"file\"; filename=\"report.csv\"\r\n\r\n"
+        yield b"a,b\n" * 1024
+        yield b"\r\n--x--\r\n"
+    response = client.post("/upload", content=chunks(), headers={"Content-Type": "multipart/form-data; boundary=x"})
+    assert response.status_code == 413
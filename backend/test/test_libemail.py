@@ -0,0 +1,89 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import email
+import socket
+import pytest
+from aiosmtpd.controller import Controller
+from app import libemail
+from app.libemail import EmailSender, SMTPDeliveryWorker
+
+class RecordingHandler:
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.connections += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return '250 Message accepted for delivery'
+
+@pytest.fixture
+def smtp_server():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    yield handler, "127.0.0.1", port
+    controller.stop()
+
+@pytest.fixture
+def smtp_env(monkeypatch):
+    monkeypatch.setenv("SENDER_EMAIL", "sender@example.com")
+    monkeypatch.setenv("SMTP_USERNAME", "user")
+    monkeypatch.setenv("SMTP_PASSWORD", "password")
+
+def make_sender(content, recipient="recipient@example.com"):
+    sender = EmailSender(recipient, "Subject", "Body", content, "report.pdf")
+    sender.setup_email()
+    return sender
+
+def attachment_names(sender):
+    return [part.get_filename() for part in sender.message.walk() if part.get_filename()]
+
+def test_small_attachment_is_not_compressed(smtp_env):
+    assert attachment_names(make_sender("# Title")) == ["report.md"]
+
+def test_large_attachment_is_zipped(smtp_env, monkeypatch):
+    monkeypatch.setattr(libemail, "ATTACHMENT_COMPRESS_THRESHOLD", 10)
+    assert attachment_names(make_sender("# A long enough title")) == ["report.zip"]
+
+def test_worker_batches_over_one_connection(smtp_env, smtp_server):
+    handler, host, port = smtp_server
+    worker = SMTPDeliveryWorker(host, port, use_tls=False)
+    for i in range(3):
+        worker.submit(make_sender(f"# Document {i}", recipient=f"user{i}@example.com"))
+    worker.join()
+    worker.stop()
+
+    assert worker.sent_count == 3
+    assert handler.connections == 1
+    assert sorted(envelope.rcpt_tos[0] for envelope in handler.messages) == [f"user{i}@example.com" for i in range(3)]
+    message = email.message_from_bytes(handler.messages[0].content)
+    assert message["Subject"] == "Subject"
+
+def test_worker_gives_up_after_retries(smtp_env):
+    # Nothing listens on this port, so every attempt fails
+    worker = SMTPDeliveryWorker("127.0.0.1", 1, use_tls=False, max_retries=2, retry_backoff=0)
+    worker.submit(make_sender("# Title"))
+    worker.join()
+    worker.stop()
+
+    assert worker.sent_count == 0
+    assert worker.failed_count == 1
+
+def test_stop_delivers_queued_messages(smtp_env, smtp_server):
+    handler, host, port = smtp_server
+    worker = SMTPDeliveryWorker(host, port, use_tls=False)
+    for i in range(5):
+        worker.submit(make_sender(f"# Document {i}", recipient=f"user{i}@example.com"))
+    assert worker.stop(timeout=30)
+
+    assert worker.sent_count == 5
+    assert len(handler.messages) == 5
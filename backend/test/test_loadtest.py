@@ -0,0 +1,83 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import openai
+import pytest
+from azure.ai.vision.imageanalysis import ImageAnalysisClient
+from azure.ai.vision.imageanalysis.models import VisualFeatures
+from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError
+from loadtest.documents import DOCUMENT_KINDS
+from loadtest.run import parse_mix, percentile, summarize
+from loadtest.stand_ins import ChatCompletionsStandIn, VisionStandIn
+
+@pytest.fixture
+def vision_stand_in():
+    server = VisionStandIn().start()
+    yield server
+    server.stop()
+
+def test_vision_stand_in_speaks_image_analysis(vision_stand_in):
+    client = ImageAnalysisClient(endpoint=vision_stand_in.url, credential=AzureKeyCredential("loadtest"))
+    result = client.analyze(image_data=b"image", visual_features=[VisualFeatures.CAPTION, VisualFeatures.READ])
+    assert result.caption.text
+    assert [line.text for block in result.read.blocks for line in block.lines] == ["LOAD TEST"]
+    assert vision_stand_in.stats["ok"] == 1
+
+def test_chat_completions_stand_in_speaks_openai():
+    server = ChatCompletionsStandIn().start()
+    try:
+        client = openai.OpenAI(api_key="loadtest", base_url=f"{server.url}/v1", max_retries=0)
+        response = client.chat.completions.create(model="gpt-3.5-turbo", messages=[{"role": "user", "content": "hello"}])
+        assert response.choices[0].message.content == "hello"
+    finally:
+        server.stop()
+
+def test_stand_in_injects_errors_and_rate_limits():
+    server = VisionStandIn(error_rate=1.0).start()
+    client = ImageAnalysisClient(endpoint=server.url, credential=AzureKeyCredential("loadtest"), retry_total=0)
+    try:
+        with pytest.raises(HttpResponseError):
+            client.analyze(image_data=b"image", visual_features=[VisualFeatures.CAPTION])
+        assert server.stats["errors"] == 1
+    finally:
+        server.stop()
+
+    server = VisionStandIn(rate_limit=1).start()
+    client = ImageAnalysisClient(endpoint=server.url, credential=AzureKeyCredential("loadtest"), retry_total=0)
+    try:
+        client.analyze(image_data=b"image", visual_features=[VisualFeatures.CAPTION])
+        with pytest.raises(HttpResponseError):
+            client.analyze(image_data=b"image", visual_features=[VisualFeatures.CAPTION])
+        assert server.stats["rate_limited"] == 1
+    finally:
+        server.stop()
+
+def test_parse_mix_and_percentile():
+    assert parse_mix("pdf=3,csv") == {"pdf": 3.0, "csv": 1.0}
+    with pytest.raises(ValueError):
+        parse_mix("xls=1")
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 99) == 99.0
+
+def test_summarize_reports_time_to_email():
+    results = [
+        {"kind": "pdf", "advanced": True, "status": 200, "error": None, "latency": 0.5, "started_at": 10.0,
+         "recipient": "loadtest+1@example.com", "emailed": True},
+        {"kind": "pdf", "advanced": True, "status": 200, "error": None, "latency": 0.5, "started_at": 11.0,
+         "recipient": "loadtest+2@example.com", "emailed": True},
+        {"kind": "csv", "advanced": False, "status": 200, "error": None, "latency": 0.1, "started_at": 12.0,
+         "recipient": None, "emailed": False},
+    ]
+    report = summarize(results, 5.0, {"loadtest+1@example.com": 14.0})
+    assert report["email_delivery"]["count"] == 2
+    assert report["email_delivery"]["errors"] == 1
+    assert report["email_delivery"]["max"] == 4.0
+
+def test_document_variants_differ():
+    for kind in ("html_images", "csv", "docx_images"):
+        _, factory = DOCUMENT_KINDS[kind]
+        assert factory(1) != factory(2)
+    _, factory = DOCUMENT_KINDS["html"]
+    assert factory(3) == factory(3)
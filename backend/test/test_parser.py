@@ -2,10 +2,34 @@ import sys
 import os 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
 import io
+import json
 from docx import Document
 import pytest
 from app.convertor.parser import PDFParser, DOCXParser, HTMLParser, CSVParser
+from app.convertor import page_store
+from app.convertor.page_store import PageResultStore
+from app.convertor import parser as parser_module
 from reportlab.pdfgen import canvas
+from reportlab.lib.utils import ImageReader
+from PIL import Image
+
+@pytest.fixture
+def page_result_store(tmp_path, monkeypatch):
+    # Give each test an empty store of its own instead of the shared default
+    store = PageResultStore(path=str(tmp_path / "pages.sqlite3"))
+    monkeypatch.setattr(parser_module, "page_result_store", store)
+    return store
+
+def make_report_pdf(pages):
+    pdf_buffer = io.BytesIO()
+    c = canvas.Canvas(pdf_buffer)
+    for font_size, lines in pages:
+        c.setFont("Helvetica", font_size)
+        for index, line in enumerate(lines):
+            c.drawString(72, 750 - index * 2 * font_size, line)
+        c.showPage()
+    c.save()
+    return pdf_buffer.getvalue()
 
 @pytest.fixture
 def sample_pdf():
@@ -17,6 +41,23 @@ def sample_pdf():
     pdf_buffer.seek(0)
     return pdf_buffer.read()
 
+@pytest.fixture
+def sample_mixed_layout_pdf():
+    # Page 1: image only, page 2: single column, page 3: two columns
+    pdf_buffer = io.BytesIO()
+    c = canvas.Canvas(pdf_buffer)
+    c.drawImage(ImageReader(Image.new("RGB", (200, 200), "red")), 100, 500, 200, 200)
+    c.showPage()
+    c.drawString(100, 750, "Single column")
+    c.drawString(100, 735, "More text")
+    c.showPage()
+    for i in range(5):
+        c.drawString(50, 750 - 15 * i, f"Left column {i}")
+        c.drawString(350, 750 - 15 * i, f"Right column {i}")
+    c.save()
+    pdf_buffer.seek(0)
+    return pdf_buffer.read()
+
 @pytest.fixture
 def sample_docx():
     # Sample DOCX content in bytes (minimal DOCX structure for testing)
@@ -51,6 +92,114 @@ def test_advanced_parse_pdf(sample_pdf):
     expected_output = "Hello, World!"
     assert expected_output in result
 
+def test_pdf_reuses_unchanged_pages(sample_pdf, page_result_store, monkeypatch):
+    parser = PDFParser()
+    parser.set_file(bytesFile=io.BytesIO(sample_pdf))
+    parser.basic_parse()
+    assert parser.reused_page_count == 0
+
+    def fail_extraction(*args, **kwargs):
+        raise AssertionError("Unchanged page was extracted again")
+    monkeypatch.setattr(PDFParser, "_extract_page_elements", fail_extraction)
+    parser = PDFParser()
+    parser.set_file(bytesFile=io.BytesIO(sample_pdf))
+    result = parser.basic_parse()
+    assert parser.reused_page_count == 1
+    assert "Hello, World!" in result
+
+def test_pdf_revision_reparses_only_changed_page(page_result_store, tmp_path, monkeypatch):
+    original = [
+        (24, ["Quarterly report"]),
+        (12, ["Revenue grew in every region.", "Costs were flat."]),
+        (12, ["Outlook", "Hiring continues."]),
+    ]
+    revised = original[:1] + [(18, ["Revised revenue figures", "Growth slowed in the north."])] + original[2:]
+    parser = PDFParser()
+    parser.set_file(bytesFile=io.BytesIO(make_report_pdf(original)))
+    parser.basic_parse()
+
+    parser = PDFParser()
+    parser.set_file(bytesFile=io.BytesIO(make_report_pdf(revised)))
+    result = parser.basic_parse()
+    info = parser.get_document_info()
+    assert info["reused_page_count"] == info["page_count"] - 1
+    assert "Revised revenue figures" in result
+    assert "Revenue grew in every region." not in result
+
+    # Reused pages must give the same document-wide font statistics as a parse from scratch
+    monkeypatch.setattr(parser_module, "page_result_store", PageResultStore(path=str(tmp_path / "empty.sqlite3")))
+    fresh = PDFParser()
+    fresh.set_file(bytesFile=io.BytesIO(make_report_pdf(revised)))
+    assert fresh.basic_parse() == result
+    assert fresh.reused_page_count == 0
+    assert parser.top_font_size == fresh.top_font_size
+    assert parser.font_size_threshold == fresh.font_size_threshold
+    assert parser.elements == fresh.elements
+
+def test_page_result_store_round_trip_and_eviction(tmp_path):
+    store = PageResultStore(path=str(tmp_path / "pages.sqlite3"), max_pages=2)
+    page_result = ("simple", [("text", 12.0, "Hello"), ("image", b"\x89PNG")])
+    store.put_page("a", True, page_result)
+    assert store.get_page("a", True) == page_result
+    assert store.get_page("a", False) is None
+    store.put_page("b", True, page_result)
+    store.put_page("c", True, page_result)
+    assert store.get_page("a", True) is None
+    assert store.get_page("c", True) == page_result
+
+def test_page_result_store_is_bounded_by_bytes(tmp_path):
+    store = PageResultStore(path=str(tmp_path / "pages.sqlite3"), max_page_bytes=3000)
+    image_page = ("image_only", [("image", b"x" * 1000)])
+    for key in "abc":
+        store.put_page(key, True, image_page)
+    # Each entry is about 1.4 KB once base64-encoded, so only the two most recent fit
+    assert store.get_page("a", True) is None
+    assert store.get_page("b", True) == image_page
+    assert store.get_page("c", True) == image_page
+    store.put_page("huge", True, ("image_only", [("image", b"x" * 10000)]))
+    assert store.get_page("huge", True) is None
+    assert store.get_page("c", True) == image_page
+
+def test_page_result_store_ignores_unreadable_entries(tmp_path):
+    store = PageResultStore(path=str(tmp_path / "pages.sqlite3"))
+    # An entry in another shape, e.g. written by an older version into the same table
+    store._put(page_store.PAGES_TABLE, "a:1", json.dumps([["text", 12.0, "Hello"]]), store.max_pages)
+    assert store.get_page("a", True) is None
+
+def test_page_result_store_refuses_unsafe_paths(tmp_path):
+    # A directory that cannot be created must not fail the parse
+    (tmp_path / "not-a-directory").write_text("")
+    broken = PageResultStore(path=str(tmp_path / "not-a-directory" / "pages.sqlite3"))
+    broken.put_page("a", True, ("simple", []))
+    assert broken.get_page("a", True) is None
+
+    shared = tmp_path / "shared"
+    shared.mkdir(mode=0o777)
+    shared.chmod(0o777)
+    store = PageResultStore(path=str(shared / "pages.sqlite3"))
+    store.put_page("a", True, ("simple", []))
+    assert store.get_page("a", True) is None
+    assert not (shared / "pages.sqlite3").exists()
+
+    private = tmp_path / "private"
+    private.mkdir(mode=0o700)
+    (private / "target").write_text("")
+    (private / "pages.sqlite3").symlink_to(private / "target")
+    store = PageResultStore(path=str(private / "pages.sqlite3"))
+    store.put_page("a", True, ("simple", []))
+    assert store.get_page("a", True) is None
+
+def test_pdf_page_triage(sample_mixed_layout_pdf, page_result_store):
+    parser = PDFParser()
+    parser.set_file(bytesFile=io.BytesIO(sample_mixed_layout_pdf))
+    info = parser.get_document_info()
+    assert info["page_count"] == 3
+    assert info["page_classes"] == {"image_only": 1, "simple": 1, "complex": 1}
+    assert info["image_count"] == 1
+    result = parser.basic_parse()
+    assert "Single column" in result
+    assert "Right column 4" in result
+
 def test_basic_parse_docx(sample_docx):
     parser = DOCXParser()
     parser.set_file(bytesFile=io.BytesIO(sample_docx))
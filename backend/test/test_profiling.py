@@ -0,0 +1,67 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import pstats
+from app import profiling
+from app.profiling import RequestProfiler, is_profiling_requested, file_hash, prune_profiles
+
+def test_profiling_disabled_by_config(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_ENABLED", False)
+    assert not is_profiling_requested({"X-DeepDoc-Profile": "1"}, {})
+
+def test_profiling_requested_by_header_or_query(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(profiling, "PROFILING_SAMPLE_RATE", 1.0)
+    assert is_profiling_requested({"X-DeepDoc-Profile": "true"}, {})
+    assert is_profiling_requested({}, {"profile": "1"})
+    assert not is_profiling_requested({}, {})
+
+def test_profiling_sample_rate(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(profiling, "PROFILING_SAMPLE_RATE", 0.0)
+    assert not is_profiling_requested({"X-DeepDoc-Profile": "1"}, {})
+
+def test_request_profiler_writes_pstats(tmp_path):
+    with RequestProfiler("req1", "upload_file", output_dir=str(tmp_path)) as profiler:
+        profiler.file_hash = file_hash(b"content")
+        sum(range(1000))
+    assert os.path.basename(profiler.path) == f"req1_{file_hash(b'content')[:16]}_upload_file.pstats"
+    assert pstats.Stats(profiler.path).total_calls > 0
+
+def test_request_profiler_disabled_writes_nothing(tmp_path):
+    with RequestProfiler("req2", "upload_file", enabled=False, output_dir=str(tmp_path)) as profiler:
+        pass
+    assert profiler.path is None
+    assert os.listdir(tmp_path) == []
+
+def test_request_profiler_sanitizes_request_id(tmp_path):
+    with RequestProfiler("../escaped/..", "upload_file", output_dir=str(tmp_path)) as profiler:
+        pass
+    assert os.path.dirname(profiler.path) == str(tmp_path)
+    assert os.path.basename(profiler.path).startswith("___escaped___")
+
+def test_nested_profilers_do_not_fail(tmp_path):
+    with RequestProfiler("outer", "stage", output_dir=str(tmp_path)) as outer:
+        with RequestProfiler("inner", "stage", output_dir=str(tmp_path)) as inner:
+            sum(range(100))
+    assert outer.path is not None
+    if sys.version_info >= (3, 12):
+        assert inner.path is None
+
+def test_prune_profiles_keeps_newest(tmp_path):
+    for index in range(5):
+        path = tmp_path / f"req{index}_nohash_stage.pstats"
+        path.write_bytes(b"")
+        os.utime(path, (index, index))
+    (tmp_path / "notes.txt").write_text("kept")
+    assert prune_profiles(str(tmp_path), 2) == 3
+    assert sorted(os.listdir(tmp_path)) == ["notes.txt", "req3_nohash_stage.pstats", "req4_nohash_stage.pstats"]
+
+def test_request_profiler_enforces_retention(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_MAX_FILES", 1)
+    old = tmp_path / "old_nohash_stage.pstats"
+    old.write_bytes(b"")
+    os.utime(old, (0, 0))
+    with RequestProfiler("new", "stage", output_dir=str(tmp_path)) as profiler:
+        pass
+    assert os.listdir(tmp_path) == [os.path.basename(profiler.path)]
@@ -0,0 +1,87 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from app import results
+from app.results import ResultStore, etag_matches, negotiate_encoding, result_hash, result_response, store_result
+
+@pytest.fixture
+def client():
+    store = ResultStore()
+    app = FastAPI()
+    body, digest, _ = store_result({"markdown": "# Title\n" + "text " * 2000}, store)
+
+    @app.get("/result")
+    def get_result(request: Request):
+        return result_response(request, body, digest, store)
+
+    return TestClient(app), digest
+
+def test_negotiate_encoding(monkeypatch):
+    monkeypatch.setattr(results, "brotli", None)
+    assert negotiate_encoding("gzip, deflate, br") == "gzip"
+    assert negotiate_encoding("gzip;q=0, identity") is None
+    assert negotiate_encoding("*") == "gzip"
+    assert negotiate_encoding(None) is None
+
+def test_etag_matches():
+    assert etag_matches('"abc"', "abc")
+    assert etag_matches('W/"abc", "def"', "def")
+    assert etag_matches("*", "abc")
+    assert not etag_matches('"abc"', "def")
+    assert not etag_matches(None, "abc")
+
+def test_result_store_evicts_least_recently_used():
+    store = ResultStore(max_bytes=10)
+    first, second, third = (result_hash(body) for body in (b"12345", b"67890", b"abcde"))
+    assert store.put(first, b"12345")
+    assert store.put(second, b"67890")
+    store.get(first)
+    store.put(third, b"abcde")
+    assert store.get(first) == b"12345"
+    assert store.get(second) is None
+
+def test_result_too_large_to_keep_is_not_stored():
+    store = ResultStore(max_bytes=10)
+    body, digest, stored = store_result({"markdown": "text " * 100}, store)
+    assert not stored
+    assert store.get(digest) is None
+
+def test_large_result_is_compressed(client, monkeypatch):
+    monkeypatch.setattr(results, "brotli", None)
+    test_client, digest = client
+    response = test_client.get("/result", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["ETag"] == f'W/"{digest}"'
+    assert response.json()["markdown"].startswith("# Title")
+
+    response = test_client.get("/result", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in response.headers
+    assert response.headers["ETag"] == f'"{digest}"'
+
+def test_matching_etag_returns_not_modified(client):
+    test_client, digest = client
+    response = test_client.get("/result", headers={"If-None-Match": f'W/"{digest}"'})
+    assert response.status_code == 304
+    assert response.content == b""
+
+def test_upload_returns_unkept_result_inline(monkeypatch):
+    from app.main import app
+    monkeypatch.setattr(results.result_store, "max_bytes", 10)
+    response = TestClient(app).post("/upload", params={"inline": "false"},
+                                    files={"file": ("report.csv", b"header1,header2\nvalue1,value2")})
+    assert response.status_code == 200
+    assert "result_url" not in response.json()
+    assert "value1" in response.json()["markdown"]
+
+def test_result_revalidates_without_being_kept():
+    from app.main import app
+    client = TestClient(app)
+    digest = result_hash(b"{}")
+    assert client.get(f"/results/{digest}").status_code == 404
+    response = client.get(f"/results/{digest}", headers={"If-None-Match": f'W/"{digest}"'})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == f'"{digest}"'
+    assert client.get(f"/results/{digest}", headers={"If-None-Match": "*"}).status_code == 404
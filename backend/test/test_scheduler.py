@@ -0,0 +1,100 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import asyncio
+import pytest
+from app.scheduler import CostClassScheduler, default_budgets, estimate_cost, parse_budgets
+
+def test_estimate_cost():
+    assert estimate_cost(".pdf", {"file_size": 10 ** 7, "page_count": 900}) == 900
+    assert estimate_cost(".docx", {"file_size": 40 * 1024, "image_count": 4}) == 4
+    assert estimate_cost(".csv", {"file_size": 100}) == 1
+
+def test_budgets():
+    assert default_budgets(8) == {"small": 4, "medium": 2, "large": 2}
+    assert default_budgets(1) == {"small": 1, "medium": 1, "large": 1}
+    assert default_budgets(2) == {"small": 2, "medium": 1, "large": 1}
+    assert default_budgets(3) == {"small": 1, "medium": 1, "large": 1}
+    assert parse_budgets("large=3", 8) == {"small": 4, "medium": 2, "large": 3}
+    with pytest.raises(ValueError):
+        parse_budgets("huge=1", 8)
+
+def test_small_jobs_do_not_wait_behind_large_ones():
+    scheduler = CostClassScheduler({"small": 1, "medium": 1, "large": 1})
+    order = []
+
+    async def job(name, cost, duration):
+        async with scheduler.slot(cost):
+            order.append(name)
+            await asyncio.sleep(duration)
+
+    async def scenario():
+        large = [asyncio.create_task(job(f"large{i}", 900, 0.1)) for i in range(3)]
+        await asyncio.sleep(0)
+        await job("small", 2, 0)
+        assert order == ["large0", "small"]
+        await asyncio.gather(*large)
+
+    asyncio.run(scenario())
+    stats = scheduler.stats()
+    assert stats["large"]["completed"] == 3
+    assert stats["large"]["wait_max"] >= 0.1
+    assert stats["small"]["wait_max"] < 0.1
+    assert all(state["running"] == 0 for state in stats.values())
+
+def test_total_running_jobs_are_capped():
+    scheduler = CostClassScheduler({"small": 1, "medium": 1, "large": 1}, max_running=1)
+    order = []
+    peak = 0
+
+    async def job(name, cost):
+        nonlocal peak
+        async with scheduler.slot(cost):
+            order.append(name)
+            peak = max(peak, scheduler.running)
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        first = asyncio.create_task(job("large0", 900))
+        await asyncio.sleep(0)
+        # Queued behind the running job, the small one still goes before the waiting large and medium ones
+        await asyncio.gather(job("large1", 900), job("medium", 100), job("small", 2), first)
+
+    asyncio.run(scenario())
+    assert peak == 1
+    assert order == ["large0", "small", "medium", "large1"]
+    assert scheduler.running == 0
+
+def test_shortest_job_first_within_class():
+    scheduler = CostClassScheduler({"small": 1, "medium": 1, "large": 1})
+    order = []
+
+    async def job(name, cost):
+        async with scheduler.slot(cost):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        first = asyncio.create_task(job("first", 500))
+        await asyncio.sleep(0)
+        await asyncio.gather(job("bigger", 900), job("smaller", 300))
+        await first
+
+    asyncio.run(scenario())
+    assert order == ["first", "smaller", "bigger"]
+
+def test_cancelled_waiter_releases_slot():
+    scheduler = CostClassScheduler({"small": 1, "medium": 1, "large": 1})
+
+    async def scenario():
+        async with scheduler.slot(1):
+            waiter = asyncio.create_task(scheduler.slot(1).__aenter__())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+        async with scheduler.slot(1):
+            pass
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
+    assert scheduler.stats()["small"]["running"] == 0
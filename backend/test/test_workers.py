@@ -0,0 +1,114 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import asyncio
+import operator
+import time
+import fitz
+import pytest
+from app.convertor.page_store import page_result_store
+from app.guardrails import JobLimitExceeded
+from app.convertor.parser import resolve_image_descriptions
+from app.workers import ConcurrencyLimiter, IsolatedJobRunner, convert_document, parse_runner, prepare_advanced_document
+
+@pytest.fixture
+def sample_csv():
+    return b'header1,header2\nvalue1,value2\nvalue3,value4'
+
+@pytest.fixture
+def sample_html_with_images():
+    images = "".join(f'<img src="https://example.com/{i}.png">' for i in range(3))
+    return f'<html><body><h1>Hello, World!</h1>{images}</body></html>'.encode()
+
+@pytest.fixture
+def sample_three_page_pdf():
+    document = fitz.open()
+    for i in range(3):
+        document.new_page().insert_text((72, 72), f"Page {i + 1} of the report")
+    return document.tobytes()
+
+def test_concurrency_limiter():
+    limiter = ConcurrencyLimiter(2)
+    assert limiter.try_acquire()
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release()
+    assert limiter.try_acquire()
+
+def test_convert_document_basic(sample_csv):
+    content, basic_info = convert_document(".csv", sample_csv, False, 10)
+    assert "value1" in content
+    assert basic_info["row_count"] == 2
+
+def test_convert_document_defers_advanced_parse(sample_html_with_images):
+    content, basic_info = convert_document(".html", sample_html_with_images, True, 2)
+    assert content is None
+    assert basic_info["image_count"] == 3
+
+def test_prepare_advanced_document_defers_image_descriptions(sample_html_with_images, monkeypatch):
+    runner = IsolatedJobRunner(max_workers=1, timeout=60, max_rss=2 * 1024 ** 3)
+    content, deferred_images = asyncio.run(runner.run(prepare_advanced_document, ".html", sample_html_with_images))
+    assert [source for _, source in deferred_images] == [f"https://example.com/{i}.png" for i in range(3)]
+    assert all(placeholder in content for placeholder, _ in deferred_images)
+
+    monkeypatch.setattr("app.convertor.parser.generate_image_description_from_url", lambda url: f"Picture {url[-5]}")
+    content = resolve_image_descriptions(content, deferred_images)
+    assert "![Image: Picture 0]" in content and "![Image: Picture 2]" in content
+    assert "\x00" not in content
+
+def test_isolated_runner_returns_result():
+    runner = IsolatedJobRunner(max_workers=1, timeout=30, max_rss=2 * 1024 ** 3)
+    assert asyncio.run(runner.run(operator.add, 1, 2)) == 3
+
+def test_isolated_runner_reports_errors():
+    runner = IsolatedJobRunner(max_workers=1, timeout=30, max_rss=2 * 1024 ** 3)
+    with pytest.raises(RuntimeError, match="division by zero"):
+        asyncio.run(runner.run(operator.truediv, 1, 0))
+
+def test_isolated_runner_enforces_time_limit():
+    runner = IsolatedJobRunner(max_workers=1, timeout=0.5, max_rss=2 * 1024 ** 3)
+    started = time.monotonic()
+    with pytest.raises(JobLimitExceeded, match="time limit"):
+        asyncio.run(runner.run(time.sleep, 30))
+    assert time.monotonic() - started < 10
+
+def test_cancelled_run_keeps_its_slot_until_the_process_is_reaped():
+    runner = IsolatedJobRunner(max_workers=1, timeout=30, max_rss=2 * 1024 ** 3)
+    live = []
+
+    async def scenario():
+        jobs = [asyncio.create_task(runner.run(time.sleep, 30)) for _ in range(3)]
+        for _ in range(3):
+            await asyncio.sleep(0.3)
+            live.append(sum(1 for process in runner._processes if process.is_alive()))
+            for job in jobs:
+                job.cancel()
+        await asyncio.gather(*jobs, return_exceptions=True)
+        assert all(job.cancelled() for job in jobs)
+
+    started = time.monotonic()
+    asyncio.run(scenario())
+    assert max(live) <= 1
+    assert not runner._processes
+    assert time.monotonic() - started < 10
+
+def test_isolated_runner_enforces_memory_limit():
+    runner = IsolatedJobRunner(max_workers=1, timeout=30, max_rss=256 * 1024 ** 2)
+    with pytest.raises(JobLimitExceeded, match="memory limit"):
+        asyncio.run(runner.run(operator.mul, b"x", 512 * 1024 ** 2))
+
+def test_parse_runner_reuses_pages_across_jobs(sample_three_page_pdf):
+    # Every job runs in a fresh process, so reuse only works if the page store outlives it.
+    # conftest points the store at a throwaway path, so clearing it here touches no real cache
+    page_result_store.clear()
+
+    async def convert_twice():
+        first = await parse_runner.run(convert_document, ".pdf", sample_three_page_pdf, False, 10)
+        second = await parse_runner.run(convert_document, ".pdf", sample_three_page_pdf, False, 10)
+        return first, second
+
+    (first_content, first_info), (second_content, second_info) = asyncio.run(convert_twice())
+    assert first_info["reused_page_count"] == 0
+    assert second_info["reused_page_count"] == 3
+    assert second_content == first_content
+    assert "Page 3 of the report" in second_content